@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:23
+
+from django.db import migrations, models
+import myauth.models
+import mysite.images
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myauth', '0002_profile_avatar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_format',
+            field=models.CharField(blank=True, editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='avatar',
+            field=mysite.images.MetadataImageField(blank=True, format_field='avatar_format', hash_field='avatar_sha256', height_field='avatar_height', null=True, size_field='avatar_size', upload_to=myauth.models.avatar_dir, width_field='avatar_width'),
+        ),
+    ]
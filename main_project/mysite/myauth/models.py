@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from django.db import models
 
+from mysite.images import MetadataImageField
+
 
 def avatar_dir(instance, filename):
     return 'profiles/profile_{pk}/{filename}'.format(
@@ -13,4 +15,18 @@ class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(max_length=500, blank=True)
     agreement_accepted = models.BooleanField(default=False)
-    avatar = models.ImageField(null=True, blank=True, upload_to=avatar_dir)
+    avatar = MetadataImageField(
+        null=True,
+        blank=True,
+        upload_to=avatar_dir,
+        width_field='avatar_width',
+        height_field='avatar_height',
+        size_field='avatar_size',
+        format_field='avatar_format',
+        hash_field='avatar_sha256',
+    )
+    avatar_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    avatar_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    avatar_size = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    avatar_format = models.CharField(max_length=10, blank=True, editable=False)
+    avatar_sha256 = models.CharField(max_length=64, blank=True, editable=False)
@@ -28,7 +28,7 @@ class AboutMeView(TemplateView):
 class UsersList(ListView):
     template_name = "myauth/users-list.html"
     context_object_name = "profiles"
-    queryset = Profile.objects.all()
+    queryset = Profile.objects.select_related('user')
 
 
 class UserDetailsView(DetailView):
@@ -0,0 +1,235 @@
+"""
+Two-tier cache backend and stampede-safe cache reads.
+
+TieredCache keeps a small LRU of recently used entries in every process (L1)
+in front of a cache shared by all workers (L2, another CACHES alias). Reads
+that hit L1 never leave the process. Writes go to L2 first. Other workers only
+see a changed entry once their own L1 copy expires, after at most L1_TIMEOUT
+seconds, so L1 suits immutable entries such as generation-versioned keys
+best. Counters and locks that must be exact should use the L2 alias directly.
+
+get_or_compute() adds single-flight recomputation (one worker recomputes a
+missing entry while the others wait for it or keep serving the stale value)
+and probabilistic early recomputation ("XFetch"), which refreshes hot entries
+shortly before they expire, so they rarely expire under load at all.
+
+LockingFileBasedCache is the file-based fallback for the shared cache: Django's
+FileBasedCache implements add() and incr() as a read followed by a write, so
+two workers can both win a lock or lose an increment. It holds an exclusive
+file lock around them instead.
+"""
+import contextlib
+import math
+import os
+import pickle
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache as default_cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import locks
+
+MISSING = object()
+
+# Django creates a backend instance per thread; like LocMemCache, the L1 store
+# and its lock are shared per LOCATION so that L1 is per process
+_l1_stores: dict[str, OrderedDict] = {}
+_l1_locks: dict[str, threading.Lock] = {}
+
+
+class TieredCache(BaseCache):
+    """
+    LOCATION names the process-local L1 store.
+    OPTIONS:
+        L2: alias of the shared cache (required)
+        L1_MAX_ENTRIES: entries kept per process, 1000 by default
+        L1_TIMEOUT: seconds an entry may live in L1, 5 by default
+    """
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l2_alias = options['L2']
+        self.l1_max_entries = int(options.get('L1_MAX_ENTRIES', 1000))
+        self.l1_timeout = float(options.get('L1_TIMEOUT', 5))
+        self.l1 = _l1_stores.setdefault(location, OrderedDict())
+        self.lock = _l1_locks.setdefault(location, threading.Lock())
+
+    @property
+    def l2(self) -> BaseCache:
+        # caches[] hands out one instance per thread, like for any other alias
+        return caches[self.l2_alias]
+
+    def l1_get(self, key: str) -> Any:
+        with self.lock:
+            entry = self.l1.get(key)
+            if entry is None:
+                return MISSING
+            pickled, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.l1[key]
+                return MISSING
+            self.l1.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def l1_set(self, key: str, value: Any, timeout: float | None) -> None:
+        # values are stored pickled, like LocMemCache does, so callers can't mutate cached objects
+        l1_timeout = self.l1_timeout if timeout is None else min(timeout, self.l1_timeout)
+        if l1_timeout <= 0:
+            self.l1_delete(key)
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.l1[key] = (pickled, time.monotonic() + l1_timeout)
+            self.l1.move_to_end(key)
+            while len(self.l1) > self.l1_max_entries:
+                self.l1.popitem(last=False)
+
+    def l1_delete(self, key: str) -> None:
+        with self.lock:
+            self.l1.pop(key, None)
+
+    @staticmethod
+    def l1_timeout_for(timeout) -> float | None:
+        # entries stored with the L2 default timeout still live in L1 for L1_TIMEOUT at most
+        return None if timeout is DEFAULT_TIMEOUT else timeout
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            self.l1_set(self.make_key(key, version), value, self.l1_timeout_for(timeout))
+        return added
+
+    def get(self, key, default=None, version=None):
+        l1_key = self.make_key(key, version)
+        value = self.l1_get(l1_key)
+        if value is not MISSING:
+            return value
+        value = self.l2.get(key, MISSING, version=version)
+        if value is MISSING:
+            return default
+        self.l1_set(l1_key, value, None)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version=version)
+        self.l1_set(self.make_key(key, version), value, self.l1_timeout_for(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l1_delete(self.make_key(key, version))
+        return self.l2.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.l1_delete(self.make_key(key, version))
+        return self.l2.delete(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self.l1_delete(self.make_key(key, version))
+        return self.l2.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.l1_get(self.make_key(key, version)) is not MISSING or self.l2.has_key(key, version=version)
+
+    def clear(self):
+        with self.lock:
+            self.l1.clear()
+        self.l2.clear()
+
+
+class LockingFileBasedCache(FileBasedCache):
+    """
+    FileBasedCache with atomic add() and incr() between the processes of one
+    host. Keys are spread over LOCK_STRIPES lock files in ``<LOCATION>/locks``,
+    so unrelated keys rarely wait for each other.
+
+    Every call still reads and writes a file, and nothing is shared between
+    hosts: use Redis (DJANGO_REDIS_URL) for anything beyond a single machine.
+    """
+    LOCK_STRIPES = 64
+
+    @contextlib.contextmanager
+    def key_lock(self, key, version=None):
+        fname = os.path.basename(self._key_to_file(key, version))
+        lock_dir = os.path.join(self._dir, 'locks')
+        os.makedirs(lock_dir, 0o700, exist_ok=True)
+        stripe = int(fname[:8], 16) % self.LOCK_STRIPES
+        with open(os.path.join(lock_dir, f'{stripe}.lock'), 'ab') as lock_file:
+            if not locks.lock(lock_file, locks.LOCK_EX):
+                raise ImproperlyConfigured(
+                    f'{self.__class__.__name__} needs file locking, which is not available here'
+                )
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self.key_lock(key, version):
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self.key_lock(key, version):
+            return super().incr(key, delta, version)
+
+    async def aincr(self, key, delta=1, version=None):
+        # BaseCache.aincr reads and writes without going through incr()
+        return await sync_to_async(self.incr, thread_sensitive=True)(key, delta, version)
+
+
+def get_or_compute(
+    key: str,
+    compute: Callable[[], Any],
+    timeout: float | None = 300,
+    cache: BaseCache = None,
+    beta: float = 1.0,
+    lock_timeout: float = 30,
+    poll_interval: float = 0.05,
+) -> Any:
+    """
+    Returns the cached value for ``key``, calling ``compute()`` to fill it.
+
+    Only one caller at a time recomputes a key, guarded by a lock taken with
+    cache.add. Callers that lose the race return the stale value if there is
+    one. Otherwise they wait up to ``lock_timeout`` for the winner, then compute
+    themselves. Entries with a timeout are recomputed early with a probability
+    that grows as expiry gets closer and with how long ``compute`` took
+    (XFetch); ``beta`` > 1 favours earlier recomputation.
+
+    Values are stored wrapped with their compute time and expiry, so keys
+    written here must only be read through this function.
+    """
+    cache = cache or default_cache
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expires_at = entry
+        if expires_at is None or time.time() - delta * beta * math.log(1 - random.random()) < expires_at:
+            return value
+
+    lock_key = f'{key}:lock'
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, lock_timeout):
+        if entry is not None:
+            return entry[0]
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(poll_interval)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+
+    try:
+        started = time.monotonic()
+        value = compute()
+        delta = time.monotonic() - started
+        expires_at = None if timeout is None else time.time() + timeout
+        cache.set(key, (value, delta, expires_at), timeout)
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+    return value
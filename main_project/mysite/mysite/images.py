@@ -0,0 +1,137 @@
+"""
+Image fields with their metadata stored in the database.
+
+A plain ImageField with width_field/height_field opens the file with Pillow
+whenever a model instance with empty dimension columns is loaded, and
+.width/.height read it on every access without them. MetadataImageField reads
+the upload once, before it is saved, and stores width, height, byte size,
+format and SHA-256 in columns of the model. A stored file is only opened when
+a row is saved with another file name than it was loaded with; rows saved
+before the columns existed are filled by the backfill_image_metadata command.
+"""
+import hashlib
+from typing import NamedTuple
+
+from django.db import models
+from django.db.models import signals
+from django.db.models.fields.files import FieldFile
+
+
+class ImageMetadata(NamedTuple):
+    width: int
+    height: int
+    size: int
+    format: str
+    sha256: str
+
+
+def read_image_metadata(file: FieldFile) -> ImageMetadata:
+    """
+    Reads an uploaded or stored image once for its metadata; Pillow only parses the header
+    """
+    from PIL import Image
+
+    was_closed = file.closed
+    if was_closed:
+        file.open('rb')
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in file.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+            image_format = image.format or ''
+    finally:
+        if was_closed:
+            file.close()
+        else:
+            file.seek(0)
+    return ImageMetadata(width, height, size, image_format, digest.hexdigest())
+
+
+class MetadataImageField(models.ImageField):
+    """
+    ImageField that stores the metadata of uploads in the model fields named by
+    width_field, height_field, size_field, format_field and hash_field (all optional)
+    """
+    def __init__(self, *args, size_field: str = None, format_field: str = None, hash_field: str = None, **kwargs):
+        self.size_field = size_field
+        self.format_field = format_field
+        self.hash_field = hash_field
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        for option in ('size_field', 'format_field', 'hash_field'):
+            if getattr(self, option):
+                kwargs[option] = getattr(self, option)
+        return name, path, args, kwargs
+
+    @property
+    def metadata_fields(self) -> dict[str, str]:
+        """
+        ImageMetadata attribute -> model field, for the configured fields
+        """
+        fields = zip(
+            ImageMetadata._fields,
+            (self.width_field, self.height_field, self.size_field, self.format_field, self.hash_field),
+        )
+        return {key: field for key, field in fields if field}
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super().contribute_to_class(cls, name, **kwargs)
+        if not cls._meta.abstract:
+            # pre_save signals run before any field's pre_save, so the values are
+            # stored whatever the order the fields are declared in
+            signals.pre_save.connect(self.store_metadata, sender=cls)
+            signals.post_init.connect(self.remember_name, sender=cls)
+            signals.post_save.connect(self.remember_name, sender=cls)
+
+    def update_dimension_fields(self, instance, force=False, *args, **kwargs):
+        # ImageField calls this on every post_init and assignment, and reads
+        # the file to do it; the metadata is stored in store_metadata instead
+        pass
+
+    @property
+    def loaded_name_attname(self) -> str:
+        return f'_{self.attname}_loaded_name'
+
+    def remember_name(self, sender, instance, update_fields=None, **kwargs) -> None:
+        """
+        Name of the file the row holds, once loaded and after each save (when
+        the field's pre_save has given an upload its final name)
+        """
+        if update_fields is not None and self.name not in update_fields:
+            return
+        # deferred fields are not in __dict__, and are not saved unless assigned
+        value = instance.__dict__.get(self.attname)
+        instance.__dict__[self.loaded_name_attname] = getattr(value, 'name', value) or None
+
+    def store_metadata(self, sender, instance, raw: bool = False, **kwargs) -> None:
+        if raw or self.attname not in instance.__dict__:
+            return
+        file = getattr(instance, self.attname)
+        loaded_name = None if instance._state.adding else instance.__dict__.get(self.loaded_name_attname)
+        if file and file._committed and file.name == loaded_name:
+            # unchanged stored file, its metadata is already saved
+            return
+        metadata = None
+        if file:
+            try:
+                metadata = read_image_metadata(file)
+            except (OSError, SyntaxError, ValueError):
+                # an assigned stored name that can't be read, left to backfill_image_metadata
+                if not file._committed:
+                    raise
+        self.set_metadata(instance, metadata)
+
+    def set_metadata(self, instance, metadata: ImageMetadata | None) -> None:
+        for key, field in self.metadata_fields.items():
+            if metadata is not None:
+                value = getattr(metadata, key)
+            else:
+                value = None if instance._meta.get_field(field).null else ''
+            setattr(instance, field, value)
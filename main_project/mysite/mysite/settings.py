@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 from os import getenv
 
@@ -51,6 +52,10 @@ INTERNAL_IPS = [
     '127.0.0.1',
 ]
 
+# The toolbar middleware is sync only, so under ASGI it would push every request
+# through a thread; the ASGI deployment profile sets DJANGO_DEBUG_TOOLBAR=0
+DEBUG_TOOLBAR = getenv('DJANGO_DEBUG_TOOLBAR', '1') == '1'
+
 ALLOWED_HOSTS = [
     '0.0.0.0',
     '127.0.0.1',
@@ -88,21 +93,27 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    # 'django.middleware.cache.UpdateCacheMiddleware',
+    'requestdataapp.middlewares.CorrelationIdMiddleware',
+    'requestdataapp.middlewares.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'requestdataapp.middlewares.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'requestdataapp.middlewares.set_useragent_on_request_middleware',
     'requestdataapp.middlewares.CountRequestsMiddleware',
+    'requestdataapp.middlewares.RateLimitMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
-    # 'django.middleware.cache.FetchFromCacheMiddleware',
 ]
 
+if not DEBUG_TOOLBAR:
+    INSTALLED_APPS.remove('debug_toolbar')
+    MIDDLEWARE.remove('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 
 ROOT_URLCONF = 'mysite.urls'
 
@@ -135,12 +146,40 @@ DATABASES = {
     }
 }
 
-# CACHES = {
-#     'default': {
-#         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-#         'LOCATION': '/var/tmp/django_cache',
-#     },
-# }
+# "default" is a per-process LRU in front of the "shared" cache (see mysite.cache).
+# "shared" is Redis when DJANGO_REDIS_URL is set. The file-based fallback is for
+# development and single-host setups only: its add/incr are atomic between the
+# workers of one host, but every rate limit hit and lock goes to disk, and
+# `manage.py check --deploy` warns about it.
+SHARED_CACHE = {
+    'BACKEND': 'mysite.cache.LockingFileBasedCache',
+    'LOCATION': getenv('DJANGO_CACHE_DIR', str(Path(tempfile.gettempdir()) / 'mysite-cache')),
+}
+if getenv('DJANGO_REDIS_URL'):
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': getenv('DJANGO_REDIS_URL'),
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'mysite.cache.TieredCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+        },
+    },
+    'shared': SHARED_CACHE,
+}
+
+# Tests run with process-local caches and a temporary METRICS_DIR, see mysite.test_runner
+TEST_RUNNER = 'mysite.test_runner.IsolatedTestRunner'
+
+# Public catalog pages are purged by model signals, the timeout only bounds how
+# long date dependent parts of the templates may go stale
+PAGE_CACHE_TIMEOUT = 60 * 60
 
 
 # Password validation
@@ -193,6 +232,11 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'uploads'
 
+# Widths of the WebP/JPEG derivatives of product images (shopapp.thumbnails) and
+# the processes resizing them; 0 resizes inline, in the thread saving the image
+THUMBNAIL_WIDTHS = (160, 320, 640, 1280)
+THUMBNAIL_WORKERS = int(getenv('DJANGO_THUMBNAIL_WORKERS', '2'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -217,36 +261,96 @@ SPECTACULAR_SETTINGS = {
     'SERVE_INCLUDE_SCHEMA': False,
 }
 
+# Request metrics: every worker process dumps its counters into METRICS_DIR,
+# the /req/metrics/ endpoint sums them in Prometheus text format
+METRICS_DIR = Path(getenv('DJANGO_METRICS_DIR', Path(tempfile.gettempdir()) / 'mysite-metrics'))
+METRICS_FLUSH_INTERVAL = 1.0
+METRICS_ALLOWED_IPS = INTERNAL_IPS + [ip for ip in getenv('DJANGO_METRICS_ALLOWED_IPS', '').split(',') if ip]
+
+# Per-client rate limits: the first rule whose regex matches the path applies,
+# None means unlimited. Counters live in RATE_LIMIT_CACHE, which has to be
+# shared between workers for the limits to hold across the whole pool.
+RATE_LIMITS = [
+    (r'^/req/metrics/$', None),
+    (r'^/(static|media)/', None),
+    (r'^/[\w-]+/shop/(products|orders)/export/$', '30/m'),
+    (r'^/[\w-]+/shop/users/\d+/orders/export/$', '30/m'),
+    (r'', '600/m'),
+]
+RATE_LIMIT_CACHE = 'shared'
+
+# SQL queries per request above which QueryBudgetMiddleware logs a warning, by URL
+# name (None turns the check off for a view), and how often one query shape may
+# repeat within a request
+QUERY_BUDGET_DEFAULT = 20
+QUERY_BUDGETS = {
+    'shopapp:products_api': 5,
+    'shopapp:orders_api': 5,
+    'shopapp:products_api_async': 5,
+    'shopapp:orders_api_async': 5,
+    # batched writes of up to 5000 products
+    'shopapp:product-bulk': 100,
+}
+QUERY_DUPLICATES_BUDGET = 5
+
+# Request profiles (requestdataapp.profiling): where to write them, the share of
+# requests profiled without being asked to, the stack sampling interval and how
+# long a token from the profiling_token command stays valid
+PROFILING_DIR = Path(getenv('DJANGO_PROFILING_DIR', Path(tempfile.gettempdir()) / 'mysite-profiles'))
+PROFILING_SAMPLE_RATE = float(getenv('DJANGO_PROFILING_SAMPLE_RATE', '0'))
+PROFILING_INTERVAL = 0.005
+PROFILING_TOKEN_MAX_AGE = 60 * 60
+
 LOGFILE_NAME = BASE_DIR / 'logger.txt'
 LOGFILE_SIZE = 1 * 1024 * 1024
 LOGFILE_COUNT = 3
 
+# Request threads only enqueue records, the "queue" handler's listener thread
+# formats them and writes to the handlers below. Handlers used as its targets must
+# have names that sort before "queue" (see requestdataapp.logs.QueueListenerHandler).
+LOG_LEVEL = getenv('DJANGO_LOG_LEVEL', 'INFO')
+# share of requests whose debug records are kept
+LOG_DEBUG_SAMPLE_RATE = float(getenv('DJANGO_LOG_DEBUG_SAMPLE_RATE', '0.01'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
-        'verbose': {
-            'format': '%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+        'json': {
+            '()': 'requestdataapp.logs.JsonFormatter',
+        },
+    },
+    'filters': {
+        'correlation_id': {
+            '()': 'requestdataapp.logs.CorrelationIdFilter',
+        },
+        'debug_sampling': {
+            '()': 'requestdataapp.logs.DebugSamplingFilter',
+            'rate': LOG_DEBUG_SAMPLE_RATE,
         },
     },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+            'formatter': 'json',
         },
         'logfile': {
             'class': 'logging.handlers.RotatingFileHandler',
             'filename': LOGFILE_NAME,
             'maxBytes': LOGFILE_SIZE,
             'backupCount': LOGFILE_COUNT,
-            'formatter': 'verbose'
-        }
+            'formatter': 'json'
+        },
+        'queue': {
+            'class': 'requestdataapp.logs.QueueListenerHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.logfile'],
+            'filters': ['correlation_id', 'debug_sampling'],
+        },
     },
     'root': {
         'handlers': [
-            'console',
-            'logfile',
+            'queue',
         ],
-        'level': 'INFO'
+        'level': LOG_LEVEL
     }
 }
\ No newline at end of file
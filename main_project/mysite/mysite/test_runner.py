@@ -0,0 +1,46 @@
+"""
+Test runner that keeps the suite away from the caches and files of a running site.
+
+The settings point the shared cache at a directory or a Redis server that real
+workers use, and METRICS_DIR at the snapshots the metrics endpoint reads. Tests
+clear caches and record metrics freely, so the whole run gets process-local
+caches and a temporary metrics directory instead.
+"""
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'mysite.cache.TieredCache',
+        'LOCATION': 'tests',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests-shared',
+    },
+}
+
+
+class IsolatedTestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.tmp_dir = tempfile.mkdtemp(prefix='mysite-tests-')
+        self.isolated_settings = override_settings(
+            CACHES=TEST_CACHES,
+            METRICS_DIR=Path(self.tmp_dir) / 'metrics',
+        )
+        self.isolated_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.isolated_settings.disable()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -23,6 +23,7 @@ from django.urls import path, include
 from django.conf.urls.i18n import i18n_patterns
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from django.contrib.sitemaps.views import sitemap
+from shopapp.caching import SITEMAP_PAGES, cache_public_page
 from .sitemaps import sitemaps
 
 
@@ -34,7 +35,7 @@ urlpatterns = [
     path('blogapp/', include('blogapp.urls')),
     path(
         'sitemap.xml',
-        sitemap,
+        cache_public_page(SITEMAP_PAGES)(sitemap),
         {
             'sitemaps': sitemaps
         },
@@ -59,6 +60,8 @@ if settings.DEBUG:
     urlpatterns.extend(
         static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
     )
+
+if settings.DEBUG and settings.DEBUG_TOOLBAR:
     urlpatterns.append(
         path('__debug__/', include('debug_toolbar.urls')),
     )
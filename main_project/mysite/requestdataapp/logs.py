@@ -0,0 +1,112 @@
+"""
+Logging pipeline.
+
+Request threads only put records on a queue (QueueListenerHandler); one
+listener thread per process formats them as JSON and does the I/O. Records
+carry the correlation id of the request they were logged in, set by
+CorrelationIdMiddleware, and debug records can be sampled per request.
+"""
+import copy
+import json
+import logging
+import queue
+import random
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+correlation_id: ContextVar[str | None] = ContextVar('correlation_id', default=None)
+
+# attributes every LogRecord has, anything else came in through extra=
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'correlation_id'}
+
+
+class CorrelationIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Lets through ``rate`` of the records at or below ``level``, all others pass.
+    Inside a request the decision depends on the correlation id only, so a
+    sampled request keeps all of its debug records.
+    """
+    def __init__(self, rate: float = 1.0, level: str | int = logging.DEBUG):
+        super().__init__()
+        self.rate = float(rate)
+        self.level = level if isinstance(level, int) else logging.getLevelName(level)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.level or self.rate >= 1:
+            return True
+        request_id = correlation_id.get()
+        if request_id is None:
+            return random.random() < self.rate
+        return zlib.crc32(request_id.encode()) % 10000 < self.rate * 10000
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'correlation_id': getattr(record, 'correlation_id', None),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    Puts records on an in-memory queue that a listener thread hands to
+    ``handlers``. In LOGGING, pass the target handlers as 'cfg://handlers.<name>'
+    references with names that sort before this handler's name: dictConfig
+    creates handlers in name order, so by then the references resolve to
+    handler instances.
+
+    When the queue is full records are dropped rather than blocking the request.
+    """
+    def __init__(self, handlers: list[logging.Handler], maxsize: int = 10000):
+        # dictConfig's ConvertingList resolves 'cfg://' references on indexing, not on iteration
+        handlers = [handlers[index] for index in range(len(handlers))]
+        for handler in handlers:
+            if not isinstance(handler, logging.Handler):
+                raise ValueError(f'{handler!r} is not a configured handler, check the handler names order')
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only merge the arguments here, exceptions are formatted by the listener
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        # logging.shutdown closes handlers newest first, so the targets are still open here
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        super().close()
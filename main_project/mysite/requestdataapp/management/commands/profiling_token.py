@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from requestdataapp.middlewares import PROFILE_HEADER
+from requestdataapp.profiling import make_profile_token
+
+
+class Command(BaseCommand):
+    """
+    Prints a signed header that makes ProfilingMiddleware profile a request, e.g.
+    curl -H "$(python manage.py profiling_token)" https://.../shop/products/
+    """
+    help = 'Print a signed X-Profile header for profiling live requests'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{PROFILE_HEADER}: {make_profile_token()}')
+        self.stderr.write(f'Valid for {settings.PROFILING_TOKEN_MAX_AGE} seconds, profiles go to {settings.PROFILING_DIR}')
@@ -0,0 +1,238 @@
+"""
+Process-wide request metrics.
+
+Every worker process keeps its own counters and histograms behind a lock and
+periodically dumps them to ``<METRICS_DIR>/metrics-<pid>-<start>.json``. The
+metrics endpoint sums the snapshots of all workers, so the numbers cover the
+whole gunicorn pool, not just the worker that answered the scrape.
+
+Snapshots of dead workers are folded into ``metrics-base.json`` and removed, so
+the directory does not grow with every restart and the pool's counters never
+go down when a worker is replaced.
+"""
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import locks
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+HELP = {
+    'django_http_requests_total': ('counter', 'Requests received, by view'),
+    'django_http_requests_by_device_total': ('counter', 'Requests received, by user agent device class'),
+    'django_http_responses_total': ('counter', 'Responses sent, by view and status'),
+    'django_http_exceptions_total': ('counter', 'Exceptions raised by views, by view and type'),
+    'django_http_request_duration_seconds': ('histogram', 'Request latency, by view'),
+    'django_db_queries_total': ('counter', 'SQL queries run while handling requests, by view'),
+    'django_db_query_duration_seconds_total': ('counter', 'Time spent in SQL queries, by view'),
+    'django_db_duplicate_queries_total': ('counter', 'Repeated runs of the same query shape within a request, by view and fingerprint'),
+    'django_db_query_budget_exceeded_total': ('counter', 'Requests over their query budget, by view'),
+}
+
+
+WORKER_SNAPSHOT_RE = re.compile(r'^metrics-(?P<pid>\d+)-\d+\.json$')
+
+
+def labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def default_worker_id() -> str:
+    # the start time keeps a recycled pid from overwriting a dead worker's snapshot
+    return f'{os.getpid()}-{time.time_ns()}'
+
+
+def pid_alive(pid: int) -> bool:
+    if os.name != 'posix':
+        # os.kill() terminates the process on Windows, keep every snapshot there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_snapshot(path: Path) -> dict | None:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def merge_snapshot(counters: dict, histograms: dict, data: dict) -> None:
+    for name, labels, value in data['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, values in data['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        total = histograms.setdefault(key, [0] * len(values))
+        for index, value in enumerate(values):
+            total[index] += value
+
+
+def dump_snapshot(counters: dict, histograms: dict) -> dict:
+    return {
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), list(values)] for (name, labels), values in histograms.items()],
+    }
+
+
+def write_snapshot(path: Path, data: dict) -> None:
+    tmp_path = path.with_suffix(f'.tmp{threading.get_ident()}')
+    tmp_path.write_text(json.dumps(data))
+    os.replace(tmp_path, path)
+
+
+class MetricsRegistry:
+    def __init__(self, directory: Path = None, flush_interval: float = None, worker_id: str = None):
+        self.directory = Path(directory or settings.METRICS_DIR)
+        self.worker_id = worker_id or default_worker_id()
+        self.flush_interval = settings.METRICS_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.lock = threading.Lock()
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, list] = {}
+        self.last_flush = 0.0
+
+    def inc(self, name: str, labels: dict, value: float = 1) -> None:
+        key = (name, labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, labels: dict, value: float) -> None:
+        key = (name, labels_key(labels))
+        with self.lock:
+            # one count per bucket, then sum and count
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dump_snapshot(self.counters, self.histograms)
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self.directory / f'metrics-{self.worker_id}.json'
+
+    @property
+    def base_path(self) -> Path:
+        return self.directory / 'metrics-base.json'
+
+    def flush(self) -> None:
+        self.last_flush = time.monotonic()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        write_snapshot(self.snapshot_path, self.snapshot())
+
+    def maybe_flush(self) -> None:
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def collect(self) -> tuple[dict, dict]:
+        """
+        Sums the snapshots of all worker processes, this one included
+        """
+        self.flush()
+        counters, histograms = {}, {}
+        # under the lock, so no snapshot is read after it was folded into the base
+        with self.directory_lock():
+            self.fold_dead_workers()
+            for path in self.directory.glob('metrics-*.json'):
+                data = read_snapshot(path)
+                if data is not None:
+                    merge_snapshot(counters, histograms, data)
+        return counters, histograms
+
+    @contextlib.contextmanager
+    def directory_lock(self):
+        with open(self.directory / 'metrics.lock', 'ab') as lock_file:
+            locks.lock(lock_file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+
+    def fold_dead_workers(self) -> None:
+        """
+        Adds the snapshots of workers that have exited to the base file and
+        removes them. Must be called under directory_lock().
+        """
+        dead = []
+        for path in self.directory.glob('metrics-*.json'):
+            match = WORKER_SNAPSHOT_RE.match(path.name)
+            if match and path != self.snapshot_path and not pid_alive(int(match['pid'])):
+                dead.append(path)
+        if not dead:
+            return
+        counters, histograms = {}, {}
+        for path in [self.base_path, *dead]:
+            data = read_snapshot(path)
+            if data is not None:
+                merge_snapshot(counters, histograms, data)
+        write_snapshot(self.base_path, dump_snapshot(counters, histograms))
+        for path in dead:
+            path.unlink(missing_ok=True)
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format 0.0.4
+        """
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, description) in HELP.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+            else:
+                for (metric, labels), values in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(LATENCY_BUCKETS, values):
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {format_value(values[-2])}')
+                    lines.append(f'{name}_count{format_labels(labels)} {values[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> MetricsRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry()
+    return _registry
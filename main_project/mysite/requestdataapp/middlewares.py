@@ -1,50 +1,435 @@
-from django.http import HttpRequest
+import logging
+import random
+import re
+import threading
 import time
+import uuid
+from typing import Callable
 
-from django.shortcuts import render
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import FileResponse, HttpRequest, HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.functional import SimpleLazyObject
 
+from .logs import correlation_id
+from .metrics import get_registry
+from .profiling import StackSampler, check_profile_token, profile_path, start_sampler, write_profile
+from .querystats import QueryStats, current_stats
+from .ratelimit import RateLimiter, Rule
+from .useragent import get_user_agent
 
-def set_useragent_on_request_middleware(get_response):
+logger = logging.getLogger(__name__)
+
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_ID_RE = re.compile(r'^[\w.-]{1,64}$')
 
-    print('Initial call')
 
-    def middleware(request: HttpRequest):
-        print('before get response')
-        request.user_agent = request.META['HTTP_USER_AGENT']
-        response = get_response(request)
-        print('after get response')
+class CorrelationIdMiddleware:
+    """
+    Gives every request a correlation id: the incoming X-Request-ID header when
+    it looks sane, a new uuid otherwise. It is set as request.correlation_id,
+    added to every log record made while handling the request (see
+    requestdataapp.logs) and echoed in the X-Request-ID response header.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = correlation_id.set(request_correlation_id(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            correlation_id.reset(token)
+        response[REQUEST_ID_HEADER] = request.correlation_id
         return response
 
+    async def __acall__(self, request: HttpRequest):
+        token = correlation_id.set(request_correlation_id(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            correlation_id.reset(token)
+        response[REQUEST_ID_HEADER] = request.correlation_id
+        return response
+
+
+def request_correlation_id(request: HttpRequest) -> str:
+    incoming = request.headers.get(REQUEST_ID_HEADER, '')
+    request.correlation_id = incoming if REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+    return request.correlation_id
+
+
+@sync_and_async_middleware
+def set_useragent_on_request_middleware(get_response):
+    """
+    Sets request.user_agent: a lazy UserAgent, parsed (and memoized per UA string)
+    only when one of its attributes is used. str() gives the raw header.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request: HttpRequest):
+            set_user_agent(request)
+            return await get_response(request)
+    else:
+        def middleware(request: HttpRequest):
+            set_user_agent(request)
+            return get_response(request)
+
     return middleware
 
 
+def set_user_agent(request: HttpRequest) -> None:
+    ua_string = request.META.get('HTTP_USER_AGENT', '')
+    request.user_agent = SimpleLazyObject(lambda: get_user_agent(ua_string))
+
+
 class CountRequestsMiddleware:
+    """
+    Records per-view request, response and exception counters and a latency
+    histogram in the process metrics registry (see requestdataapp.metrics)
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
-        self.requests_count = 0
-        self.responses_count = 0
-        self.exceptions_count = 0
-        self.request_time = {}
+        self.metrics = get_registry()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request: HttpRequest):
-        time_delay = 0
-        if not self.request_time:
-            print('Первый запрос')
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    def record(self, request: HttpRequest, response: HttpResponse, duration: float) -> None:
+        view = view_name(request)
+        self.metrics.inc('django_http_requests_total', {'view': view})
+        user_agent = getattr(request, 'user_agent', None)
+        if user_agent is not None:
+            self.metrics.inc('django_http_requests_by_device_total', {'device': user_agent.device})
+        self.metrics.inc('django_http_responses_total', {'view': view, 'status': response.status_code})
+        self.metrics.observe('django_http_request_duration_seconds', {'view': view}, duration)
+        self.metrics.maybe_flush()
+
+    def process_exception(self, request: HttpRequest, exception: Exception):
+        self.metrics.inc(
+            'django_http_exceptions_total',
+            {'view': view_name(request), 'exception': type(exception).__name__},
+        )
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the SQL queries, database time and repeated query shapes of every
+    request (see requestdataapp.querystats) and adds them to the metrics registry
+    per view. Logs a warning when a view runs more queries than its QUERY_BUDGETS
+    entry allows, or the same query more than QUERY_DUPLICATES_BUDGET times,
+    which is what an N+1 looks like. Streaming responses are accounted for once
+    their content has been consumed.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.metrics = get_registry()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        token = current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request: HttpRequest):
+        stats = QueryStats()
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request: HttpRequest, response: HttpResponse, stats: QueryStats) -> HttpResponse:
+        if response.streaming and not response.is_async and not isinstance(response, FileResponse):
+            response.streaming_content = self.stream(request, response.streaming_content, stats)
         else:
-            if round(time.time()) - self.request_time['time'] < time_delay and self.request_time['ip'] == request.META.get(
-                    'REMOTE_ADDR'):
-                print('Слишком быстро!')
-                return render(request, 'requestdataapp/error-time.html')
+            self.record(request, stats)
+        return response
 
-        self.request_time = {'time': round(time.time()), 'ip': request.META.get('REMOTE_ADDR')}
+    def stream(self, request: HttpRequest, content, stats: QueryStats):
+        iterator = iter(content)
+        while True:
+            # set around every chunk: the server may consume chunks in another context
+            token = current_stats.set(stats)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                current_stats.reset(token)
+            yield chunk
+        self.record(request, stats)
 
-        self.requests_count += 1
-        print('Requests count:', self.requests_count)
-        response = self.get_response(request)
-        self.responses_count += 1
-        print('Responses count:', self.responses_count)
+    def record(self, request: HttpRequest, stats: QueryStats) -> None:
+        view = view_name(request)
+        self.metrics.inc('django_db_queries_total', {'view': view}, stats.count)
+        self.metrics.inc('django_db_query_duration_seconds_total', {'view': view}, stats.duration)
+        duplicates = stats.duplicates()
+        for fingerprint, count in duplicates:
+            self.metrics.inc('django_db_duplicate_queries_total', {'view': view, 'fingerprint': fingerprint}, count - 1)
+
+        budget = settings.QUERY_BUDGETS.get(view, settings.QUERY_BUDGET_DEFAULT)
+        over_budget = budget is not None and stats.count > budget
+        n_plus_one = bool(duplicates) and duplicates[0][1] > settings.QUERY_DUPLICATES_BUDGET
+        if not (over_budget or n_plus_one):
+            return
+
+        self.metrics.inc('django_db_query_budget_exceeded_total', {'view': view})
+        repeated = [
+            {'fingerprint': fingerprint, 'count': count, 'sql': stats.samples[fingerprint][:300]}
+            for fingerprint, count in duplicates[:3]
+        ]
+        logger.warning(
+            'Query budget exceeded by %s: %d queries in %.1f ms (budget %s), most repeated: %s',
+            view,
+            stats.count,
+            stats.duration * 1000,
+            budget,
+            ', '.join(f'{item["fingerprint"]} x{item["count"]}' for item in repeated) or '-',
+            extra={
+                'view': view,
+                'queries': stats.count,
+                'db_time_ms': round(stats.duration * 1000, 3),
+                'budget': budget,
+                'repeated_queries': repeated,
+            },
+        )
+
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_PARAM = '_profile'
+
+
+class ProfiledStream:
+    """
+    Streaming content that ends its request's profile once it is consumed or
+    the response is closed, so producing the content is sampled too
+    """
+    def __init__(self, content, done: Callable[[], None]):
+        self.content = content
+        self.done = done
+        self.finished = False
+
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if not self.finished:
+            self.finished = True
+            self.done()
+
+
+class AsyncProfiledStream(ProfiledStream):
+    async def __aiter__(self):
+        try:
+            async for chunk in self.content:
+                yield chunk
+        finally:
+            self.close()
+
+
+class ProfilingMiddleware:
+    """
+    Samples the stack of requests that carry a valid signed X-Profile header
+    (see the profiling_token command), staff requests with ?_profile=1 and a
+    PROFILING_SAMPLE_RATE share of all others, and writes a flamegraph-ready
+    profile to PROFILING_DIR (see requestdataapp.profiling). The file name is
+    returned in the X-Profile-File header.
+
+    Under ASGI the event loop thread is sampled, so the async code of
+    concurrent requests shows up in the profile as well, and so is the thread
+    a sync view runs in, from process_view on; middleware that runs in other
+    sync_to_async threads before the view is not sampled. Streaming responses
+    are sampled until their content is consumed or closed, so the file is
+    written after the response has been sent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        wanted = profile_requested(request)
+        if wanted is None:
+            wanted = is_staff(request)
+        if not wanted:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        sampler = request._profile_sampler = start_sampler(settings.PROFILING_INTERVAL)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            sampler.stop()
+            raise
+        return self.finish(request, response, sampler, started)
+
+    async def __acall__(self, request: HttpRequest):
+        wanted = profile_requested(request)
+        if wanted is None:
+            wanted = await sync_to_async(is_staff)(request)
+        if not wanted:
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        sampler = request._profile_sampler = start_sampler(settings.PROFILING_INTERVAL)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            sampler.stop()
+            raise
+        return self.finish(request, response, sampler, started)
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        # a sync method: under ASGI Django runs it in the thread the request's
+        # sync code, the view included, runs in
+        sampler = getattr(request, '_profile_sampler', None)
+        if sampler is not None:
+            sampler.add_thread(threading.get_ident())
+        return None
+
+    def finish(self, request: HttpRequest, response: HttpResponse, sampler: StackSampler, started: float) -> HttpResponse:
+        name = '-'.join((
+            time.strftime('%Y%m%d-%H%M%S'),
+            view_name(request),
+            getattr(request, 'correlation_id', None) or uuid.uuid4().hex,
+        ))
+        response['X-Profile-File'] = profile_path(settings.PROFILING_DIR, name).name
+
+        def done():
+            self.save(request, name, sampler.stop(), time.perf_counter() - started)
+
+        if not response.streaming:
+            done()
+        elif response.is_async:
+            response.streaming_content = AsyncProfiledStream(response.streaming_content, done)
+        else:
+            response.streaming_content = ProfiledStream(response.streaming_content, done)
         return response
 
-    def process_exception(self, request: HttpRequest, exception: Exception):
-        self.exceptions_count += 1
-        print('got', self.exceptions_count, 'exceptions so far')
\ No newline at end of file
+    @staticmethod
+    def save(request: HttpRequest, name: str, stacks, duration: float) -> None:
+        path = write_profile(settings.PROFILING_DIR, name, stacks)
+        logger.info(
+            'Profiled %s in %.1f ms, %d samples: %s',
+            request.path, duration * 1000, stacks.total(), path,
+            extra={'profile': str(path)},
+        )
+
+
+def profile_requested(request: HttpRequest) -> bool | None:
+    """
+    None means the answer depends on request.user, which may need the database
+    """
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        return check_profile_token(token, settings.PROFILING_TOKEN_MAX_AGE)
+    if request.GET.get(PROFILE_QUERY_PARAM):
+        return None
+    return settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def is_staff(request: HttpRequest) -> bool:
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+def view_name(request: HttpRequest) -> str:
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else '<unresolved>'
+
+
+class RateLimitMiddleware:
+    """
+    Limits requests per client (user id when logged in, IP otherwise) with the
+    first RATE_LIMITS rule whose pattern matches the path. Over the limit the
+    client gets 429 Too Many Requests with a Retry-After header.
+
+    Under ASGI only limited paths leave the event loop: resolving request.user
+    (session and user lookups) and the cache backends are sync in Django 4.2,
+    so the check runs in one sync_to_async call.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limiter = RateLimiter(settings.RATE_LIMITS, settings.RATE_LIMIT_CACHE)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        rule = self.limiter.rule_for(request.path_info)
+        if rule is not None and rule.limit is not None:
+            response = self.check(rule, request)
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    async def __acall__(self, request: HttpRequest):
+        rule = self.limiter.rule_for(request.path_info)
+        if rule is not None and rule.limit is not None:
+            response = await sync_to_async(self.check)(rule, request)
+            if response is not None:
+                return response
+        return await self.get_response(request)
+
+    def check(self, rule: Rule, request: HttpRequest) -> HttpResponse | None:
+        retry_after = self.limiter.hit(rule, client_id(request))
+        if retry_after is None:
+            return None
+        response = HttpResponse('Too many requests', status=429, content_type='text/plain')
+        response['Retry-After'] = str(retry_after)
+        return response
+
+
+def client_id(request: HttpRequest) -> str:
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'ip:{request.META.get("REMOTE_ADDR")}'
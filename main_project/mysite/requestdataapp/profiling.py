@@ -0,0 +1,99 @@
+"""
+Statistical request profiler.
+
+While a profiled request runs, a helper thread looks at the stacks of the
+threads working on it every PROFILING_INTERVAL seconds and counts identical
+stacks. The result is
+written in the collapsed ("folded") format read by flamegraph.pl, speedscope and
+inferno: one ``outer;inner;innermost count`` line per distinct stack.
+Requests that are not profiled pay for a header lookup and a random() call.
+"""
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+
+from django.core import signing
+
+SIGNING_SALT = 'requestdataapp.profiling'
+SIGNED_VALUE = 'profile'
+UNSAFE_CHARS_RE = re.compile(r'[^\w.-]')
+
+
+def make_profile_token() -> str:
+    """
+    Value for the X-Profile header, valid for PROFILING_TOKEN_MAX_AGE seconds
+    """
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign(SIGNED_VALUE)
+
+
+def check_profile_token(token: str, max_age: int) -> bool:
+    try:
+        return signing.TimestampSigner(salt=SIGNING_SALT).unsign(token, max_age=max_age) == SIGNED_VALUE
+    except signing.BadSignature:
+        return False
+
+
+@lru_cache(maxsize=4096)
+def short_filename(filename: str) -> str:
+    # the longest sys.path entry the file lives in gives its module-like path
+    prefixes = [path for path in sys.path if path and filename.startswith(path + os.sep)]
+    return filename[len(max(prefixes, key=len)) + 1:] if prefixes else filename
+
+
+def collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        name = getattr(code, 'co_qualname', code.co_name)  # co_qualname is new in Python 3.11
+        names.append(f'{name} ({short_filename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_ids = {thread_id}
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def add_thread(self, thread_id: int) -> None:
+        """
+        Samples another thread too, e.g. the one an ASGI server runs a sync view in
+        """
+        self.thread_ids = self.thread_ids | {thread_id}
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[collapse(frame)] += 1
+
+    def stop(self) -> Counter:
+        self.stopped.set()
+        self.join()
+        return self.stacks
+
+
+def start_sampler(interval: float) -> StackSampler:
+    sampler = StackSampler(threading.get_ident(), interval)
+    sampler.start()
+    return sampler
+
+
+def profile_path(directory: Path, name: str) -> Path:
+    return Path(directory) / f'{UNSAFE_CHARS_RE.sub("_", name)}.folded'
+
+
+def write_profile(directory: Path, name: str, stacks: Counter) -> Path:
+    path = profile_path(directory, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(''.join(f'{stack} {count}\n' for stack, count in stacks.most_common()))
+    return path
@@ -0,0 +1,71 @@
+"""
+Per-request SQL accounting.
+
+Every database connection gets one permanent execute wrapper (installed on
+connection_created). Outside a request it only checks a context variable; inside
+one, QueryBudgetMiddleware has put a QueryStats there and the wrapper adds the
+query count, time and SQL fingerprint to it. Context variables follow the
+request through sync_to_async, so ORM calls made under ASGI are counted too.
+"""
+import re
+import time
+import zlib
+from collections import Counter
+from contextvars import ContextVar
+from functools import lru_cache
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+current_stats: ContextVar['QueryStats | None'] = ContextVar('current_query_stats', default=None)
+
+# IN (%s, %s, ...) lists of any length are the same query shape
+IN_LIST_RE = re.compile(r'\bIN \((?:%s, )*%s\)')
+NUMBER_RE = re.compile(r'\b\d+\b')
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        # one SQL text per fingerprint, for reports
+        self.samples: dict[str, str] = {}
+
+    def duplicates(self) -> list[tuple[str, int]]:
+        """
+        Fingerprints run more than once, most repeated first
+        """
+        return [(fingerprint, count) for fingerprint, count in self.fingerprints.most_common() if count > 1]
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    return NUMBER_RE.sub('N', IN_LIST_RE.sub('IN (...)', sql))
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql: str) -> str:
+    return format(zlib.crc32(normalize_sql(sql).encode()), '08x')
+
+
+def record_queries(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.duration += time.perf_counter() - started
+        stats.count += 1
+        key = fingerprint(sql)
+        stats.fingerprints[key] += 1
+        stats.samples.setdefault(key, sql)
+
+
+@receiver(connection_created, dispatch_uid='requestdataapp.querystats.install_wrapper')
+def install_wrapper(sender, connection, **kwargs) -> None:
+    # connection_created fires again on every reconnect of the same wrapper object
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
@@ -0,0 +1,113 @@
+import math
+import re
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from mysite.cache import LockingFileBasedCache
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class Rule(NamedTuple):
+    index: int
+    pattern: re.Pattern
+    limit: int | None
+    window: int
+
+
+def parse_rate(rate: str | None) -> tuple[int | None, int]:
+    """
+    '30/m' -> (30, 60); None means no limit
+    """
+    if rate is None:
+        return None, 0
+    count, _, period = rate.partition('/')
+    return int(count), PERIODS[period]
+
+
+class RateLimiter:
+    """
+    Sliding window rate limiter on top of a (shared) Django cache.
+
+    Each client gets a counter per fixed window; a hit is allowed while
+    ``previous * (share of the previous window still in range) + current``
+    stays within the limit, which smooths out bursts at window edges.
+    Counters live in the cache, so limits hold across worker processes as long
+    as the cache is shared between them.
+    """
+    def __init__(self, rules: list[tuple[str, str | None]], cache_alias: str = 'default'):
+        self.rules = [
+            Rule(index, re.compile(pattern), *parse_rate(rate))
+            for index, (pattern, rate) in enumerate(rules)
+        ]
+        self.cache = caches[cache_alias]
+
+    def rule_for(self, path: str) -> Rule | None:
+        for rule in self.rules:
+            if rule.pattern.search(path):
+                return rule
+        return None
+
+    def hit(self, rule: Rule, client: str) -> int | None:
+        """
+        Counts a request. Returns None if it is allowed, otherwise seconds to wait
+        """
+        now = time.time()
+        window_number, elapsed = divmod(now, rule.window)
+        current_key = f'ratelimit:{rule.index}:{client}:{int(window_number)}'
+        previous_key = f'ratelimit:{rule.index}:{client}:{int(window_number) - 1}'
+
+        self.cache.add(current_key, 0, rule.window * 2)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            current = 1
+            self.cache.set(current_key, current, rule.window * 2)
+        previous = self.cache.get(previous_key, 0)
+
+        remaining_share = (rule.window - elapsed) / rule.window
+        if previous * remaining_share + current <= rule.limit:
+            return None
+
+        if current > rule.limit or not previous:
+            wait = rule.window - elapsed
+        else:
+            # when the previous window's weight has decayed enough to fit this hit
+            wait = rule.window - (rule.limit - current) * rule.window / previous - elapsed
+        return max(1, math.ceil(wait))
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_rate_limit_cache(app_configs, **kwargs) -> list[checks.CheckMessage]:
+    """
+    Rate limits only hold if every worker counts in the same place, atomically
+    """
+    backend = caches[settings.RATE_LIMIT_CACHE]
+    if isinstance(backend, (LocMemCache, DummyCache)):
+        return [checks.Error(
+            f'RATE_LIMIT_CACHE "{settings.RATE_LIMIT_CACHE}" is not shared between worker processes.',
+            hint='Set DJANGO_REDIS_URL.',
+            id='requestdataapp.E001',
+        )]
+    if isinstance(backend, LockingFileBasedCache):
+        return [checks.Warning(
+            f'RATE_LIMIT_CACHE "{settings.RATE_LIMIT_CACHE}" is file-based: it is only shared by '
+            f'the workers of one host and writes to disk on every request.',
+            hint='Set DJANGO_REDIS_URL.',
+            id='requestdataapp.W001',
+        )]
+    if isinstance(backend, FileBasedCache):
+        return [checks.Error(
+            f'RATE_LIMIT_CACHE "{settings.RATE_LIMIT_CACHE}" uses FileBasedCache, whose add() and '
+            f'incr() lose updates between processes.',
+            hint='Set DJANGO_REDIS_URL, or use mysite.cache.LockingFileBasedCache on a single host.',
+            id='requestdataapp.E002',
+        )]
+    return []
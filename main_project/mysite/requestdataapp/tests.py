@@ -1,3 +1,400 @@
-from django.test import TestCase
+import json
+import logging
+import tempfile
+import threading
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from requestdataapp.logs import (
+    CorrelationIdFilter,
+    DebugSamplingFilter,
+    JsonFormatter,
+    QueueListenerHandler,
+    correlation_id,
+)
+from requestdataapp.metrics import MetricsRegistry
+from requestdataapp.middlewares import (
+    CorrelationIdMiddleware,
+    CountRequestsMiddleware,
+    ProfilingMiddleware,
+    QueryBudgetMiddleware,
+    RateLimitMiddleware,
+    set_useragent_on_request_middleware,
+)
+from requestdataapp.profiling import StackSampler, make_profile_token
+from requestdataapp.querystats import normalize_sql
+from requestdataapp.ratelimit import RateLimiter
+from requestdataapp.useragent import get_user_agent, parse_user_agent
+
+
+class MetricsRegistryTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_workers_are_aggregated(self):
+        first = MetricsRegistry(self.directory.name, flush_interval=0, worker_id='1')
+        second = MetricsRegistry(self.directory.name, flush_interval=0, worker_id='2')
+        first.inc('django_http_requests_total', {'view': 'shop'})
+        second.inc('django_http_requests_total', {'view': 'shop'}, 2)
+        second.observe('django_http_request_duration_seconds', {'view': 'shop'}, 0.02)
+        second.flush()
+
+        text = first.render()
+        self.assertIn('django_http_requests_total{view="shop"} 3', text)
+        self.assertIn('django_http_request_duration_seconds_bucket{view="shop",le="0.01"} 0', text)
+        self.assertIn('django_http_request_duration_seconds_bucket{view="shop",le="0.025"} 1', text)
+        self.assertIn('django_http_request_duration_seconds_count{view="shop"} 1', text)
+
+    def test_dead_workers_are_folded_into_the_base(self):
+        dead_pid = 2 ** 22 + 1  # above pid_max, never a live process
+        registry = MetricsRegistry(self.directory.name, flush_interval=0)
+        dead = MetricsRegistry(self.directory.name, flush_interval=0, worker_id=f'{dead_pid}-1')
+        dead.inc('django_http_requests_total', {'view': 'shop'}, 2)
+        dead.flush()
+        registry.inc('django_http_requests_total', {'view': 'shop'})
+
+        self.assertIn('django_http_requests_total{view="shop"} 3', registry.render())
+        self.assertFalse(dead.snapshot_path.exists())
+        self.assertTrue(registry.base_path.exists())
+        # a worker reusing the pid starts a new snapshot instead of replacing the old totals
+        recycled = MetricsRegistry(self.directory.name, flush_interval=0, worker_id=f'{dead_pid}-2')
+        recycled.flush()
+        self.assertIn('django_http_requests_total{view="shop"} 3', registry.render())
+
+
+class MetricsViewTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        registry = MetricsRegistry(directory.name, flush_interval=0)
+        patcher = mock.patch('requestdataapp.metrics._registry', registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_metrics_are_exposed(self):
+        self.client.get(reverse('requestdataapp:user-form'), HTTP_USER_AGENT='Mozilla/5.0')
+        response = self.client.get(reverse('requestdataapp:metrics'), HTTP_USER_AGENT='Mozilla/5.0')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'django_http_requests_total{view="requestdataapp:user-form"} 1')
+        self.assertContains(response, 'django_http_responses_total{status="200",view="requestdataapp:user-form"} 1')
+
+    def test_metrics_are_not_public(self):
+        response = self.client.get(
+            reverse('requestdataapp:metrics'),
+            HTTP_USER_AGENT='Mozilla/5.0',
+            REMOTE_ADDR='192.0.2.1',
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class RateLimiterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_limit_per_client(self):
+        limiter = RateLimiter([(r'^/export/', '2/m'), (r'^/static/', None)])
+        rule = limiter.rule_for('/export/')
+
+        self.assertIsNone(limiter.hit(rule, 'ip:1'))
+        self.assertIsNone(limiter.hit(rule, 'ip:1'))
+        retry_after = limiter.hit(rule, 'ip:1')
+        self.assertTrue(1 <= retry_after <= 60)
+        self.assertIsNone(limiter.hit(rule, 'ip:2'))
+
+        self.assertIsNone(limiter.rule_for('/static/').limit)
+        self.assertIsNone(limiter.rule_for('/other/'))
+
+    @override_settings(RATE_LIMITS=[(r'^/req/bio/$', '2/m')])
+    def test_middleware_returns_429(self):
+        url = reverse('requestdataapp:user-form')
+        for _ in range(2):
+            self.assertEqual(self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0').status_code, 200)
+
+        response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+
+        response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0', REMOTE_ADDR='192.0.2.1')
+        self.assertEqual(response.status_code, 200)
+
+
+class UserAgentTestCase(TestCase):
+    def test_classification(self):
+        cases = [
+            (
+                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                'Chrome/119.0.0.0 Safari/537.36 Edg/119.0.2151.58',
+                ('Edge', '119.0.2151.58', 'Windows', 'desktop', False),
+            ),
+            (
+                'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 '
+                '(KHTML, like Gecko) Version/17.1 Mobile/15E148 Safari/604.1',
+                ('Safari', '17.1', 'iOS', 'mobile', False),
+            ),
+            (
+                'Mozilla/5.0 (Linux; Android 13; SM-X700) AppleWebKit/537.36 (KHTML, like Gecko) '
+                'Chrome/119.0.0.0 Safari/537.36',
+                ('Chrome', '119.0.0.0', 'Android', 'tablet', False),
+            ),
+            (
+                'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+                ('Other', '', 'Other', 'bot', True),
+            ),
+            ('', ('Other', '', 'Other', 'other', False)),
+        ]
+        for ua_string, expected in cases:
+            with self.subTest(ua_string=ua_string):
+                user_agent = get_user_agent(ua_string)
+                self.assertEqual(
+                    (user_agent.browser, user_agent.browser_version, user_agent.os, user_agent.device, user_agent.is_bot),
+                    expected,
+                )
+
+    def test_parsing_is_lazy_and_memoized(self):
+        parse_user_agent.cache_clear()
+        self.client.get(reverse('requestdataapp:user-form'), HTTP_USER_AGENT='lazy-test/1.0')
+        self.client.get(reverse('requestdataapp:user-form'), HTTP_USER_AGENT='lazy-test/1.0')
+        info = parse_user_agent.cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 1)
+
+    def test_missing_header(self):
+        response = self.client.get(reverse('requestdataapp:user-form'))
+        self.assertEqual(response.status_code, 200)
+
+
+class AsyncMiddlewareTestCase(TestCase):
+    def test_middlewares_follow_handler_mode(self):
+        def get_response(request):
+            return HttpResponse()
+
+        async def aget_response(request):
+            return HttpResponse()
+
+        for middleware in (
+            CorrelationIdMiddleware,
+            set_useragent_on_request_middleware,
+            CountRequestsMiddleware,
+            QueryBudgetMiddleware,
+            ProfilingMiddleware,
+            RateLimitMiddleware,
+        ):
+            with self.subTest(middleware=middleware.__name__):
+                self.assertFalse(iscoroutinefunction(middleware(get_response)))
+                self.assertTrue(iscoroutinefunction(middleware(aget_response)))
+
+    @override_settings(RATE_LIMITS=[(r'^/req/bio/$', '1/m')])
+    async def test_asgi_request(self):
+        cache.clear()
+        url = reverse('requestdataapp:user-form')
+
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 429)
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LoggingPipelineTestCase(TestCase):
+    def make_record(self, level=logging.INFO, msg='Saved %s', args=('file.txt',), **extra):
+        record = logging.LogRecord('shopapp.views', level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter(self):
+        token = correlation_id.set('abc123')
+        try:
+            record = self.make_record(user_id=7)
+            CorrelationIdFilter().filter(record)
+        finally:
+            correlation_id.reset(token)
+
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data['message'], 'Saved file.txt')
+        self.assertEqual(data['level'], 'INFO')
+        self.assertEqual(data['correlation_id'], 'abc123')
+        self.assertEqual(data['user_id'], 7)
+
+    def test_queue_handler_hands_records_to_listener(self):
+        target = CollectingHandler()
+        handler = QueueListenerHandler([target])
+        handler.handle(self.make_record())
+        handler.close()
+
+        self.assertEqual(len(target.records), 1)
+        self.assertEqual(target.records[0].getMessage(), 'Saved file.txt')
+
+    def test_debug_sampling(self):
+        sampling = DebugSamplingFilter(rate=0)
+        self.assertFalse(sampling.filter(self.make_record(logging.DEBUG)))
+        self.assertTrue(sampling.filter(self.make_record(logging.INFO)))
+        self.assertTrue(DebugSamplingFilter(rate=1).filter(self.make_record(logging.DEBUG)))
+
+    def test_correlation_id_header(self):
+        url = reverse('requestdataapp:user-form')
+        response = self.client.get(url)
+        generated = response.headers['X-Request-ID']
+        self.assertRegex(generated, r'^[0-9a-f]{32}$')
+
+        response = self.client.get(url, HTTP_X_REQUEST_ID='upstream-id.1')
+        self.assertEqual(response.headers['X-Request-ID'], 'upstream-id.1')
+
+        response = self.client.get(url, HTTP_X_REQUEST_ID='bad id\n')
+        self.assertNotEqual(response.headers['X-Request-ID'], 'bad id\n')
+
+
+class QueryBudgetTestCase(TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry(directory=tempfile.mkdtemp(), flush_interval=3600, worker_id='test')
+        patcher = mock.patch('requestdataapp.middlewares.get_registry', return_value=self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def counter(self, name, **labels):
+        return self.registry.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql('SELECT * FROM t WHERE id IN (%s, %s, %s) LIMIT 21'),
+            normalize_sql('SELECT * FROM t WHERE id IN (%s) LIMIT 5'),
+        )
+
+    @staticmethod
+    def n_plus_one(request):
+        for username in ('a', 'b', 'c'):
+            User.objects.filter(username=username).exists()
+        return HttpResponse()
+
+    @override_settings(QUERY_BUDGET_DEFAULT=None, QUERY_DUPLICATES_BUDGET=2)
+    def test_repeated_queries_are_reported(self):
+        middleware = QueryBudgetMiddleware(self.n_plus_one)
+
+        with self.assertLogs('requestdataapp.middlewares', 'WARNING') as logs:
+            middleware(RequestFactory().get('/'))
+        self.assertIn('x3', logs.output[0])
+        self.assertEqual(self.counter('django_db_queries_total', view='<unresolved>'), 3)
+        self.assertEqual(self.counter('django_db_query_budget_exceeded_total', view='<unresolved>'), 1)
+
+        with override_settings(QUERY_DUPLICATES_BUDGET=3), self.assertNoLogs('requestdataapp.middlewares', 'WARNING'):
+            middleware(RequestFactory().get('/'))
+
+    def test_streaming_response_is_counted_when_consumed(self):
+        def get_response(request):
+            rows = (str(User.objects.count()) for _ in range(2))
+            return StreamingHttpResponse(rows)
+
+        response = QueryBudgetMiddleware(get_response)(RequestFactory().get('/'))
+        self.assertEqual(self.counter('django_db_queries_total', view='<unresolved>'), 0)
+        b''.join(response.streaming_content)
+        self.assertEqual(self.counter('django_db_queries_total', view='<unresolved>'), 2)
+
+    @override_settings(QUERY_BUDGETS={'requestdataapp:user-form': 0})
+    def test_over_budget(self):
+        self.client.force_login(User.objects.create_user(username='budget_user'))
+
+        with self.assertLogs('requestdataapp.middlewares', 'WARNING') as logs:
+            self.client.get(reverse('requestdataapp:user-form'))
+        self.assertIn('budget 0', logs.output[0])
+
+
+def busy_profiled_function(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.settings = override_settings(PROFILING_DIR=self.directory, PROFILING_SAMPLE_RATE=0, PROFILING_INTERVAL=0.001)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.url = reverse('requestdataapp:user-form')
+
+    def test_sampler_collapses_stacks(self):
+        sampler = StackSampler(threading.get_ident(), 0.001)
+        sampler.start()
+        busy_profiled_function(0.05)
+        stacks = sampler.stop()
+
+        self.assertTrue(stacks)
+        stack = stacks.most_common(1)[0][0]
+        self.assertIn('busy_profiled_function (', stack.split(';')[-1])
+
+    def test_signed_header(self):
+        response = self.client.get(self.url, HTTP_X_PROFILE=make_profile_token())
+        profile = self.directory / response.headers['X-Profile-File']
+        self.assertRegex(profile.read_text(), r'^\S.* \d+\n')
+
+        response = self.client.get(self.url, HTTP_X_PROFILE='profile:forged')
+        self.assertNotIn('X-Profile-File', response.headers)
+
+    def test_query_flag_is_staff_only(self):
+        self.client.force_login(User.objects.create_user(username='profiled_user'))
+        self.assertNotIn('X-Profile-File', self.client.get(self.url, {'_profile': 1}).headers)
+
+        self.client.force_login(User.objects.create_user(username='profiled_staff', is_staff=True))
+        self.assertIn('X-Profile-File', self.client.get(self.url, {'_profile': 1}).headers)
+
+    def test_sample_rate(self):
+        with override_settings(PROFILING_SAMPLE_RATE=1):
+            self.assertIn('X-Profile-File', self.client.get(self.url).headers)
+        self.assertNotIn('X-Profile-File', self.client.get(self.url).headers)
+        self.assertEqual(len(list(self.directory.iterdir())), 1)
+
+    async def test_asgi_samples_the_sync_view_thread(self):
+        def slow_render(*args, **kwargs):
+            busy_profiled_function(0.05)
+            return HttpResponse()
+
+        # without the sync only debug toolbar, as deployed under ASGI, the middleware runs on the event loop
+        middleware = [name for name in settings.MIDDLEWARE if not name.startswith('debug_toolbar.')]
+        with override_settings(MIDDLEWARE=middleware), mock.patch('requestdataapp.views.render', slow_render):
+            response = await self.async_client.get(self.url, headers={'X-Profile': make_profile_token()})
+        profile = (self.directory / response.headers['X-Profile-File']).read_text()
+        self.assertIn('busy_profiled_function (', profile)
+
+    def test_streaming_content_is_sampled(self):
+        def chunks():
+            busy_profiled_function(0.05)
+            yield b'data'
+
+        middleware = ProfilingMiddleware(lambda request: StreamingHttpResponse(chunks()))
+        request = RequestFactory().get('/', HTTP_X_PROFILE=make_profile_token())
+        response = middleware(request)
+        profile = self.directory / response.headers['X-Profile-File']
+        self.assertFalse(profile.exists())
+
+        self.assertEqual(b''.join(response.streaming_content), b'data')
+        self.assertIn('busy_profiled_function (', profile.read_text())
+
+        # a response closed before its content is read ends the profile too
+        response = middleware(request)
+        response.close()
+        self.assertTrue((self.directory / response.headers['X-Profile-File']).exists())
+
+    def test_profiling_token_command(self):
+        out = StringIO()
+        call_command('profiling_token', stdout=out, stderr=StringIO())
+        self.assertTrue(out.getvalue().startswith('X-Profile: profile:'))
@@ -0,0 +1,85 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+CACHE_SIZE = 1024
+# longer strings are cut before parsing so the cache stays bounded in memory too
+MAX_LENGTH = 512
+
+BOT_RE = re.compile(
+    r'bot|crawl|spider|slurp|curl|wget|python-requests|httpclient|headless|'
+    r'facebookexternalhit|monitor|preview|scanner',
+    re.IGNORECASE,
+)
+
+# first match wins, so more specific browsers go before the ones they imitate
+BROWSERS = [
+    ('Edge', re.compile(r'Edg(?:e|A|iOS)?/([\d.]+)')),
+    ('Opera', re.compile(r'(?:OPR|Opera)/([\d.]+)')),
+    ('Samsung Internet', re.compile(r'SamsungBrowser/([\d.]+)')),
+    ('Chrome', re.compile(r'(?:Chrome|CriOS)/([\d.]+)')),
+    ('Firefox', re.compile(r'(?:Firefox|FxiOS)/([\d.]+)')),
+    ('Safari', re.compile(r'Version/([\d.]+).*Safari/')),
+    ('Internet Explorer', re.compile(r'(?:MSIE |Trident/.*rv:)([\d.]+)')),
+]
+
+OPERATING_SYSTEMS = [
+    ('Windows', re.compile(r'Windows')),
+    ('Android', re.compile(r'Android')),
+    ('iOS', re.compile(r'iPhone|iPad|iPod')),
+    ('Chrome OS', re.compile(r'CrOS')),
+    ('macOS', re.compile(r'Mac OS X|Macintosh')),
+    ('Linux', re.compile(r'Linux')),
+]
+
+TABLET_RE = re.compile(r'iPad|Tablet|Android(?!.*Mobile)')
+MOBILE_RE = re.compile(r'Mobi|iPhone|iPod|Android.*Mobile')
+DESKTOP_OS = {'Windows', 'macOS', 'Linux', 'Chrome OS'}
+
+
+class UserAgent(NamedTuple):
+    ua_string: str
+    browser: str
+    browser_version: str
+    os: str
+    device: str
+    is_bot: bool
+
+    def __str__(self) -> str:
+        return self.ua_string
+
+
+def match_first(rules: list, ua_string: str) -> tuple[str, str]:
+    for name, regex in rules:
+        match = regex.search(ua_string)
+        if match:
+            return name, match.group(1) if regex.groups else ''
+    return 'Other', ''
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_user_agent(ua_string: str) -> UserAgent:
+    """
+    Classifies a User-Agent header into browser, OS and device class
+    (bot, mobile, tablet, desktop or other). Results are memoized per string.
+    """
+    browser, version = match_first(BROWSERS, ua_string)
+    os, _ = match_first(OPERATING_SYSTEMS, ua_string)
+    is_bot = bool(BOT_RE.search(ua_string))
+
+    if is_bot:
+        device = 'bot'
+    elif TABLET_RE.search(ua_string):
+        device = 'tablet'
+    elif MOBILE_RE.search(ua_string):
+        device = 'mobile'
+    elif os in DESKTOP_OS:
+        device = 'desktop'
+    else:
+        device = 'other'
+
+    return UserAgent(ua_string, browser, version, os, device, is_bot)
+
+
+def get_user_agent(ua_string: str) -> UserAgent:
+    return parse_user_agent(ua_string[:MAX_LENGTH])
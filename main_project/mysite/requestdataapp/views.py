@@ -1,7 +1,13 @@
+import logging
+
+from django.conf import settings
 from django.core.files.storage import FileSystemStorage
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
 from .forms import UserBioForm, UploadFileForm
+from .metrics import get_registry
+
+logger = logging.getLogger(__name__)
 
 
 def process_get_view(request: HttpRequest) -> HttpResponse:
@@ -33,10 +39,16 @@ def handle_file_upload(request: HttpRequest) -> HttpResponse:
             #     return render(request, 'requestdataapp/error-load.html')
             fs = FileSystemStorage()
             filename = fs.save(myfile.name, myfile)
-            print('Saved file', filename)
+            logger.info('Saved uploaded file %s', filename)
     else:
         form = UploadFileForm()
     context = {
         'form':form,
     }
-    return render(request, 'requestdataapp/file-upload.html', context=context)
\ No newline at end of file
+    return render(request, 'requestdataapp/file-upload.html', context=context)
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(get_registry().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
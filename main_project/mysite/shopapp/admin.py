@@ -1,5 +1,3 @@
-from csv import DictReader
-
 from django.contrib import admin
 from django.db.models import QuerySet
 from django.http import HttpRequest, HttpResponse
@@ -9,6 +7,8 @@ from django.urls import path
 from .models import Product, Order, ProductImage
 from .admin_mixins import ExportAsCSVMixin
 from .forms import CSVImportForm
+from .importers import import_orders_csv
+from .signals import purge_product_pages
 from io import TextIOWrapper
 
 
@@ -19,14 +19,21 @@ class OrderInline(admin.TabularInline):
 class ProductInline(admin.StackedInline):
     model = ProductImage
 
+def set_archived(queryset: QuerySet, archived: bool) -> None:
+    # update() sends no signals, so the caches that follow products are told here
+    product_ids = list(queryset.values_list('pk', flat=True))
+    queryset.update(archived=archived)
+    purge_product_pages(*product_ids)
+
+
 @admin.action(description="Archive products")
 def mark_archived(modeladmin:admin.ModelAdmin, request:HttpRequest, queryset: QuerySet):
-    queryset.update(archived=True)
+    set_archived(queryset, True)
 
 
 @admin.action(description="Unarchive products")
 def mark_unarchived(modeladmin:admin.ModelAdmin, request:HttpRequest, queryset: QuerySet):
-    queryset.update(archived=False)
+    set_archived(queryset, False)
 
 
 class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
@@ -82,7 +89,7 @@ class OrderAdmin(admin.ModelAdmin):
     inlines = [
         ProductInline
     ]
-    list_display = 'delivery_address', 'promocode', 'created_at', 'user_verbose'
+    list_display = 'delivery_address', 'promocode', 'created_at', 'user_verbose', 'total_amount', 'items_count'
 
     def get_queryset(self, request):
         return Order.objects.select_related('user').prefetch_related('products')
@@ -109,25 +116,16 @@ class OrderAdmin(admin.ModelAdmin):
             form.files['csv_file'].file,
             encoding=request.encoding,
         )
+        report = import_orders_csv(csv_file)
 
-        reader = DictReader(csv_file)
-        orders = [
-            row for row in reader
-        ]
-        print('orders', orders)
-        for row in orders:
-            print('row', row)
-            instance = Order.objects.create(
-                delivery_address=row['delivery_address'],
-                promocode=row['promocode'],
-                user_id=row['user']
-            )
-            for prod in row['products'].split('.'):
-                instance.products.add(prod)
-
-            print('instance', instance)
+        if report.errors:
+            context = {
+                'form': CSVImportForm(),
+                'report': report,
+            }
+            return render(request, 'admin/csv_form.html', context=context)
 
-        self.message_user(request, 'Orders from CSV was imported!')
+        self.message_user(request, f'{report.imported} orders from CSV were imported!')
         return redirect('..')
 
     def get_urls(self):
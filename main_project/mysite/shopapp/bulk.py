@@ -0,0 +1,131 @@
+"""
+Bulk product changes for the catalog sync API.
+
+A request is validated item by item without queries; the ids it references
+(products to update, created_by users) are then looked up with one query
+each. Valid items are written with bulk_create / bulk_update in batches in one
+transaction, invalid ones are reported back with their errors, like rows of
+an orders import. bulk_create and bulk_update send no signals, so the search
+index, page caches, conditional GET validators and, on price changes, order
+totals are refreshed here.
+"""
+from typing import Iterable
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .caching import (
+    ORDERS_GENERATION,
+    PRODUCT_DETAILS_PAGES,
+    PRODUCTS_FEED_PAGES,
+    PRODUCTS_GENERATION,
+    PRODUCTS_LIST_PAGES,
+    SITEMAP_PAGES,
+    bump_generations,
+    bump_user_orders_generation,
+    purge_pages,
+)
+from .models import Order, Product
+from .search import index_products
+from .serializers import ProductBulkCreateSerializer, ProductBulkUpdateSerializer
+from .totals import recalculate_order_totals
+
+BATCH_SIZE = 500
+
+
+def item_result(index: int, status: str, pk: int = None, errors: dict = None) -> dict:
+    result = {'index': index, 'status': status, 'pk': pk}
+    if errors:
+        result['errors'] = errors
+    return result
+
+
+def validate_items(items: list, serializer_class, partial: bool = False) -> tuple[dict[int, dict], dict[int, dict]]:
+    """
+    Returns validated data and errors, both by item index
+    """
+    valid, errors = {}, {}
+    for index, item in enumerate(items):
+        serializer = serializer_class(data=item, partial=partial)
+        if serializer.is_valid():
+            valid[index] = serializer.validated_data
+        else:
+            errors[index] = serializer.errors
+
+    user_ids = {data['created_by_id'] for data in valid.values() if data.get('created_by_id') is not None}
+    known_users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    for index, data in list(valid.items()):
+        user_id = data.get('created_by_id')
+        if user_id is not None and user_id not in known_users:
+            errors[index] = {'created_by': [f'Invalid pk "{user_id}" - object does not exist.']}
+            del valid[index]
+    return valid, errors
+
+
+def refresh_after_commit(products: Iterable[Product]) -> None:
+    products = list(products)
+    index_products(products)
+    transaction.on_commit(lambda: bump_generations(PRODUCTS_GENERATION))
+    transaction.on_commit(lambda: purge_pages(
+        PRODUCTS_LIST_PAGES,
+        SITEMAP_PAGES,
+        PRODUCTS_FEED_PAGES,
+        *(PRODUCT_DETAILS_PAGES.format(pk=product.pk) for product in products),
+    ))
+
+
+def refresh_order_totals(product_ids: Iterable[int]) -> None:
+    order_ids = (Order.products.through.objects
+                 .filter(product_id__in=product_ids)
+                 .values_list('order_id', flat=True)
+                 .distinct())
+    user_ids = {order.user_id for order in recalculate_order_totals(order_ids)}
+    transaction.on_commit(lambda: bump_user_orders_generation(*user_ids))
+    transaction.on_commit(lambda: bump_generations(ORDERS_GENERATION))
+
+
+def bulk_create_products(items: list) -> list[dict]:
+    valid, errors = validate_items(items, ProductBulkCreateSerializer)
+    results = {index: item_result(index, 'invalid', errors=item_errors) for index, item_errors in errors.items()}
+
+    with transaction.atomic():
+        products = Product.objects.bulk_create(
+            [Product(**data) for data in valid.values()],
+            batch_size=BATCH_SIZE,
+        )
+        refresh_after_commit(products)
+    for index, product in zip(valid, products):
+        results[index] = item_result(index, 'created', product.pk)
+    return [results[index] for index in range(len(items))]
+
+
+def bulk_update_products(items: list) -> list[dict]:
+    valid, errors = validate_items(items, ProductBulkUpdateSerializer, partial=True)
+    results = {index: item_result(index, 'invalid', errors=item_errors) for index, item_errors in errors.items()}
+
+    with transaction.atomic():
+        products = Product.objects.select_for_update().in_bulk([data['pk'] for data in valid.values()])
+        changed, fields = {}, set()
+        for index, data in valid.items():
+            pk = data['pk']
+            if pk not in products:
+                results[index] = item_result(index, 'invalid', pk, {'pk': [f'Product {pk} does not exist.']})
+                continue
+            if pk in changed:
+                results[index] = item_result(index, 'invalid', pk, {'pk': [f'Product {pk} is updated by item {changed[pk]}.']})
+                continue
+            changed[pk] = index
+            product = products[pk]
+            for field, value in data.items():
+                if field != 'pk':
+                    setattr(product, field, value)
+                    fields.add(field)
+            results[index] = item_result(index, 'updated', pk)
+
+        updated = [products[pk] for pk in changed]
+        if updated and fields:
+            Product.objects.bulk_update(updated, sorted(fields), batch_size=BATCH_SIZE)
+            refresh_after_commit(updated)
+            if fields & {'price', 'discount'}:
+                refresh_order_totals(changed)
+    return [results[index] for index in range(len(items))]
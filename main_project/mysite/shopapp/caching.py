@@ -0,0 +1,139 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.http import HttpRequest
+from django.utils.translation import get_language
+
+from .models import Product
+from .thumbnails import has_thumbnails
+
+# Generation counters change under other workers' feet, so they are kept in the
+# shared cache, not behind the per-process tier of the default one. The entries
+# they version never change and are fine to keep in the default cache.
+GENERATIONS_CACHE = 'shared'
+
+
+def get_generation(key: str) -> int:
+    # A missing counter starts from the current time, so a counter evicted
+    # from the cache never comes back with a value that was already used.
+    return caches[GENERATIONS_CACHE].get_or_set(key, time.time_ns, None)
+
+
+def get_changed_at(key: str) -> float:
+    """
+    Unix time of the last bump of a generation. Unknown (e.g. evicted) means now,
+    so it can't make anything look older than it is.
+    """
+    return caches[GENERATIONS_CACHE].get_or_set(f'{key}_changed_at', time.time, None)
+
+
+def bump_generations(*keys: str) -> None:
+    generations = caches[GENERATIONS_CACHE]
+    changed_at = time.time()
+    for key in set(keys):
+        try:
+            generations.incr(key)
+        except ValueError:
+            generations.set(key, time.time_ns(), None)
+        generations.set(f'{key}_changed_at', changed_at, None)
+
+
+# bumped by signals on any product / order change
+PRODUCTS_GENERATION = 'products_generation'
+ORDERS_GENERATION = 'orders_generation'
+
+
+def user_orders_generation_key(user_id: int) -> str:
+    return f'user_orders_generation_{user_id}'
+
+
+def get_user_orders_generation(user_id: int) -> int:
+    return get_generation(user_orders_generation_key(user_id))
+
+
+def bump_user_orders_generation(*user_ids: int) -> None:
+    bump_generations(*(user_orders_generation_key(user_id) for user_id in user_ids if user_id is not None))
+
+
+def user_orders_export_cache_key(user_id: int) -> str:
+    generation = get_user_orders_generation(user_id)
+    return f'user_orders_data_export_{user_id}_v{generation}'
+
+
+# Page groups of the public catalog, see cache_public_page
+PRODUCTS_LIST_PAGES = 'products_list'
+PRODUCT_DETAILS_PAGES = 'product_details:{pk}'
+SITEMAP_PAGES = 'sitemap'
+PRODUCTS_FEED_PAGES = 'products_feed'
+
+
+def product_card_version(product: Product) -> str:
+    """
+    Version of a product card fragment, taken from the fields the card shows,
+    so updates made without signals (queryset.update) are picked up too
+    """
+    state = '|'.join(map(str, (
+        product.name,
+        product.price,
+        product.discount,
+        product.preview.name if product.preview else '',
+        has_thumbnails(product.preview),
+        product.created_by.username if product.created_by_id else '',
+    )))
+    return hashlib.md5(state.encode(), usedforsecurity=False).hexdigest()
+
+
+def page_generation_key(group: str) -> str:
+    return f'page_generation_{group}'
+
+
+def purge_pages(*groups: str) -> None:
+    """
+    Drops every cached variant (language, query string, host) of the page groups
+    """
+    bump_generations(*(page_generation_key(group) for group in groups))
+
+
+def page_cache_key(group: str, request: HttpRequest) -> str:
+    variant = '|'.join((request.get_host(), get_language() or '', request.get_full_path()))
+    digest = hashlib.md5(variant.encode(), usedforsecurity=False).hexdigest()
+    return f'page_{group}_v{get_generation(page_generation_key(group))}_{digest}'
+
+
+def cache_public_page(group: str, timeout: int = None):
+    """
+    Caches successful GET responses for anonymous users under a page group;
+    ``group`` is formatted with the URL kwargs, e.g. 'product_details:{pk}'.
+    Authenticated users always get a fresh page, so permission dependent parts
+    are never served from or stored in the cache. Responses that set cookies
+    aren't stored either.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request: HttpRequest, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            key = page_cache_key(group.format(**kwargs), request)
+            response = cache.get(key)
+            if response is not None:
+                return response
+
+            response = view(request, *args, **kwargs)
+
+            def store(response):
+                if response.status_code == 200 and not response.streaming and not response.cookies:
+                    cache.set(key, response, settings.PAGE_CACHE_TIMEOUT if timeout is None else timeout)
+
+            if hasattr(response, 'render') and callable(response.render):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+            return response
+
+        return wrapper
+
+    return decorator
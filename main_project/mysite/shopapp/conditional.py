@@ -0,0 +1,68 @@
+"""
+Conditional GET for the API and export endpoints that clients poll.
+
+Validators are known without building the response: one aggregate query gives
+the row count and newest created_at (which catches bulk inserts that send no
+signals), and a generation counter bumped by signals on every change catches
+updates and deletes. Unchanged data is answered with 304 Not Modified.
+"""
+import hashlib
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple
+
+from django.db.models import Count, Max, QuerySet
+from django.http import HttpRequest
+from django.views.decorators.http import condition
+
+from .caching import (
+    ORDERS_GENERATION,
+    PRODUCTS_GENERATION,
+    get_changed_at,
+    get_generation,
+    user_orders_generation_key,
+)
+from .models import Order, Product
+
+
+class Validators(NamedTuple):
+    etag: str
+    last_modified: datetime
+
+
+def compute_validators(queryset: QuerySet, generation_key: str) -> Validators:
+    stats = queryset.aggregate(count=Count('pk'), newest=Max('created_at'))
+    generation = get_generation(generation_key)
+    changed_at = datetime.fromtimestamp(get_changed_at(generation_key), timezone.utc)
+
+    newest = stats['newest']
+    state = f'{stats["count"]}:{newest.isoformat() if newest else ""}:{generation}'
+    etag = '"{}"'.format(hashlib.md5(state.encode(), usedforsecurity=False).hexdigest())
+    return Validators(etag, max(newest, changed_at) if newest else changed_at)
+
+
+def products_validators(request: HttpRequest, **kwargs) -> Validators:
+    return compute_validators(Product.objects.all(), PRODUCTS_GENERATION)
+
+
+def orders_validators(request: HttpRequest, **kwargs) -> Validators:
+    return compute_validators(Order.objects.all(), ORDERS_GENERATION)
+
+
+def user_orders_validators(request: HttpRequest, user_id: int, **kwargs) -> Validators:
+    return compute_validators(Order.objects.filter(user_id=user_id), user_orders_generation_key(user_id))
+
+
+def conditional_view(get_validators: Callable[..., Validators]):
+    """
+    django.views.decorators.http.condition with both validators taken from
+    a single get_validators(request, **url_kwargs) call
+    """
+    def validators(request: HttpRequest, *args, **kwargs) -> Validators:
+        if getattr(request, '_validators', None) is None:
+            request._validators = get_validators(request, **kwargs)
+        return request._validators
+
+    return condition(
+        etag_func=lambda request, *args, **kwargs: validators(request, *args, **kwargs).etag,
+        last_modified_func=lambda request, *args, **kwargs: validators(request, *args, **kwargs).last_modified,
+    )
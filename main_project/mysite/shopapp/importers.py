@@ -0,0 +1,133 @@
+from csv import DictReader
+from decimal import Decimal
+from typing import Iterable, NamedTuple, TextIO
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError, transaction
+
+from .caching import ORDERS_GENERATION, PRODUCTS_FEED_PAGES, bump_generations, bump_user_orders_generation, purge_pages
+from .models import Order
+from .streaming import batched
+from .totals import product_amounts
+
+
+class RowError(NamedTuple):
+    line: int
+    message: str
+
+
+class ParsedRow(NamedTuple):
+    line: int
+    delivery_address: str
+    promocode: str
+    user_id: int | None
+    product_ids: list[int]
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.errors: list[RowError] = []
+
+    @property
+    def failed(self) -> int:
+        return len(self.errors)
+
+
+def parse_row(line: int, row: dict) -> ParsedRow:
+    """
+    Raises ValueError with a readable message when the row is malformed
+    """
+    missing = {'delivery_address', 'promocode', 'user', 'products'} - row.keys()
+    if missing:
+        raise ValueError(f'missing columns: {", ".join(sorted(missing))}')
+
+    user = (row['user'] or '').strip()
+    products = (row['products'] or '').strip()
+    try:
+        user_id = int(user) if user else None
+        product_ids = [int(pk) for pk in products.split('.') if pk] if products else []
+    except ValueError:
+        raise ValueError(f'user and products must be integer ids, got {user!r} and {products!r}')
+
+    return ParsedRow(
+        line=line,
+        delivery_address=row['delivery_address'] or '',
+        promocode=row['promocode'] or '',
+        user_id=user_id,
+        product_ids=product_ids,
+    )
+
+
+def import_orders_batch(rows: list[ParsedRow], report: ImportReport) -> None:
+    user_ids = {row.user_id for row in rows if row.user_id is not None}
+    product_ids = {pk for row in rows for pk in row.product_ids}
+    known_users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    # amount per known product, for the orders' totals
+    known_products = product_amounts(product_ids)
+
+    valid_rows = []
+    for row in rows:
+        if row.user_id is not None and row.user_id not in known_users:
+            report.errors.append(RowError(row.line, f'unknown user {row.user_id}'))
+            continue
+        unknown_products = sorted(set(row.product_ids) - known_products.keys())
+        if unknown_products:
+            report.errors.append(RowError(row.line, f'unknown products {unknown_products}'))
+            continue
+        valid_rows.append(row)
+
+    if not valid_rows:
+        return
+
+    try:
+        with transaction.atomic():
+            orders = Order.objects.bulk_create([
+                Order(
+                    delivery_address=row.delivery_address,
+                    promocode=row.promocode,
+                    user_id=row.user_id,
+                    total_amount=sum((known_products[pk] for pk in set(row.product_ids)), Decimal(0)),
+                    items_count=len(set(row.product_ids)),
+                )
+                for row in valid_rows
+            ])
+            Order.products.through.objects.bulk_create([
+                Order.products.through(order_id=order.pk, product_id=product_id)
+                for order, row in zip(orders, valid_rows)
+                for product_id in set(row.product_ids)
+            ])
+            # bulk_create sends no signals, so refresh the users' export caches and the feed here
+            imported_user_ids = [row.user_id for row in valid_rows]
+            transaction.on_commit(lambda: bump_user_orders_generation(*imported_user_ids))
+            transaction.on_commit(lambda: bump_generations(ORDERS_GENERATION))
+            transaction.on_commit(lambda: purge_pages(PRODUCTS_FEED_PAGES))
+    except DatabaseError as exc:
+        report.errors.extend(RowError(row.line, f'batch rolled back: {exc}') for row in valid_rows)
+        return
+
+    report.imported += len(valid_rows)
+
+
+def import_orders_csv(csv_file: TextIO, batch_size: int = 1000) -> ImportReport:
+    """
+    Imports orders from a CSV with delivery_address, promocode, user and products
+    columns, where products are dot-separated product ids. Rows are streamed and
+    written in batches, each batch in its own transaction. Malformed rows and rows
+    referencing unknown users or products are skipped and listed in the report.
+    """
+    report = ImportReport()
+    reader = DictReader(csv_file)
+
+    def parsed_rows() -> Iterable[ParsedRow]:
+        for row in reader:
+            try:
+                yield parse_row(reader.line_num, row)
+            except ValueError as exc:
+                report.errors.append(RowError(reader.line_num, str(exc)))
+
+    for batch in batched(parsed_rows(), batch_size):
+        import_orders_batch(batch, report)
+
+    report.errors.sort()
+    return report
@@ -0,0 +1,46 @@
+from django.apps import apps
+from django.core.management import BaseCommand
+from django.db.models import Q
+
+from mysite.images import MetadataImageField, read_image_metadata
+
+
+class Command(BaseCommand):
+    """
+    Stores the metadata of MetadataImageField files saved before it was recorded
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-read files that already have metadata')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for model in apps.get_models():
+            for field in model._meta.fields:
+                if isinstance(field, MetadataImageField) and field.metadata_fields:
+                    self.backfill(model, field, options['force'], options['batch_size'])
+
+    def backfill(self, model, field: MetadataImageField, force: bool, batch_size: int) -> None:
+        queryset = model._default_manager.exclude(**{field.name: ''}).exclude(**{f'{field.name}__isnull': True})
+        if not force:
+            missing = Q()
+            for name in field.metadata_fields.values():
+                missing |= Q(**{f'{name}__isnull': True}) if model._meta.get_field(name).null else Q(**{name: ''})
+            queryset = queryset.filter(missing)
+
+        # keys first, the rows are updated while this runs
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+        updated, unreadable = 0, 0
+        for start in range(0, len(pks), batch_size):
+            batch = []
+            for instance in model._default_manager.filter(pk__in=pks[start:start + batch_size]).only('pk', field.name):
+                try:
+                    metadata = read_image_metadata(getattr(instance, field.attname))
+                except (OSError, SyntaxError, ValueError) as exc:
+                    # missing files and files Pillow can't parse
+                    unreadable += 1
+                    self.stderr.write(f'{model._meta.label} {instance.pk}: {exc}')
+                    continue
+                field.set_metadata(instance, metadata)
+                batch.append(instance)
+            updated += model._default_manager.bulk_update(batch, field.metadata_fields.values())
+        self.stdout.write(f'{model._meta.label}.{field.name}: {updated} updated, {unreadable} unreadable')
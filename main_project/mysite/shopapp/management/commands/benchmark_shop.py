@@ -0,0 +1,233 @@
+import json
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from shopapp.management.commands.seed_shop import range_argument
+from shopapp.models import Product
+from shopapp.seeding import SeedConfig, seed_shop
+
+HANDLERS = ('wsgi', 'asgi')
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(samples: list[float], percent: int) -> float:
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[percent - 1]
+
+
+class Command(BaseCommand):
+    """
+    Seeds a throwaway data set, requests every shop URL in-process and reports
+    latency percentiles, query count and peak memory as JSON, per request handler.
+    All seeded data is rolled back at the end.
+
+    ``--handlers wsgi asgi`` runs every URL through both the WSGI handler (what
+    gunicorn sync workers run) and the ASGI one (uvicorn workers) and adds the
+    ASGI/WSGI p50 ratio per URL under "comparison".
+
+    Caches are isolated too: the run gets its own tiered cache over a file
+    cache in a temporary directory. Entries cached for seeded ids would
+    otherwise outlive the rollback and be served to real rows that get the
+    same ids later.
+    """
+    help = 'Benchmark shop views and API against seeded data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--orders-per-user', type=range_argument, default=(0, 20), help='e.g. 5-15')
+        parser.add_argument('--products-per-order', type=range_argument, default=(1, 5), help='e.g. 1-5')
+        parser.add_argument('--iterations', type=int, default=20, help='timed requests per URL')
+        parser.add_argument('--warmup', type=int, default=2, help='untimed requests per URL')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', nargs='*', help='benchmark only these URL names')
+        parser.add_argument('--handlers', nargs='+', choices=HANDLERS, default=['wsgi'])
+        parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        report = {}
+        cache_dir = tempfile.mkdtemp(prefix='shop-benchmark-cache-')
+        try:
+            with self.isolated_caches(cache_dir), transaction.atomic():
+                self.seed(options)
+                results = {handler: self.run_benchmarks(handler, options) for handler in options['handlers']}
+                report = {
+                    'meta': self.meta(options),
+                    'results': results,
+                }
+                if len(results) == len(HANDLERS):
+                    report['comparison'] = self.compare(results)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+        data = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(data)
+            self.stderr.write(self.style.SUCCESS(f'Benchmark report written to {options["output"]}'))
+        else:
+            self.stdout.write(data)
+
+    @staticmethod
+    def isolated_caches(cache_dir: str) -> override_settings:
+        # same layout as the site's caches, with the file-based fallback as the shared tier
+        return override_settings(CACHES={
+            'default': {**settings.CACHES['default'], 'LOCATION': 'benchmark'},
+            'shared': {'BACKEND': 'mysite.cache.LockingFileBasedCache', 'LOCATION': cache_dir},
+        })
+
+    def meta(self, options) -> dict:
+        return {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'volumes': {
+                'users': options['users'],
+                'products': options['products'],
+                'orders_per_user': options['orders_per_user'],
+                'products_per_order': options['products_per_order'],
+            },
+            'iterations': options['iterations'],
+            'debug_toolbar': settings.DEBUG_TOOLBAR,
+        }
+
+    def seed(self, options):
+        config = SeedConfig(
+            users=options['users'],
+            products=options['products'],
+            orders_per_user=options['orders_per_user'],
+            products_per_order=options['products_per_order'],
+            seed=options['seed'],
+        )
+        result = seed_shop(config, progress=self.stderr.write)
+
+        self.staff = User.objects.create_superuser(username=f'bench_staff_{time.time_ns()}', password=None)
+        self.product = Product.objects.filter(pk=result.first_product_id).first()
+        self.user = User.objects.filter(pk=result.first_user_id).first() or self.staff
+
+    def urls(self) -> dict[str, str]:
+        with translation.override('en'):
+            urls = {
+                'shopapp:products_list': reverse('shopapp:products_list'),
+                'shopapp:orders_list': reverse('shopapp:orders_list'),
+                'shopapp:products-export': reverse('shopapp:products-export'),
+                'shopapp:orders-export': reverse('shopapp:orders-export'),
+                'shopapp:user_orders_export': reverse('shopapp:user_orders_export', kwargs={'user_id': self.user.pk}),
+                'shopapp:product-list': reverse('shopapp:product-list'),
+                'shopapp:product-list?search': reverse('shopapp:product-list') + '?search=product',
+                'shopapp:order-list': reverse('shopapp:order-list'),
+                'shopapp:products_api': reverse('shopapp:products_api'),
+                'shopapp:orders_api': reverse('shopapp:orders_api'),
+                'shopapp:products_api_async': reverse('shopapp:products_api_async'),
+                'shopapp:orders_api_async': reverse('shopapp:orders_api_async'),
+                'shopapp:products_feed': reverse('shopapp:products_feed'),
+                'django.contrib.sitemaps.views.sitemap': reverse('django.contrib.sitemaps.views.sitemap'),
+            }
+            if self.product:
+                urls['shopapp:product_details'] = reverse('shopapp:product_details', kwargs={'pk': self.product.pk})
+        return urls
+
+    @staticmethod
+    def client(handler: str) -> Client | AsyncClient:
+        # a client address outside INTERNAL_IPS keeps the debug toolbar out of the measurements,
+        # failing views are reported with their status instead of aborting the run
+        if handler == 'asgi':
+            return AsyncClient(raise_request_exception=False, client=['192.0.2.1', 0])
+        return Client(raise_request_exception=False, REMOTE_ADDR='192.0.2.1')
+
+    def run_benchmarks(self, handler: str, options) -> dict:
+        # the middleware chain is built when the client is created, after the overrides
+        # the benchmark client would run into the per-client rate limits
+        with override_settings(RATE_LIMITS=[], ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            client = self.client(handler)
+            client.force_login(self.staff)
+            results = {}
+            for name, url in self.urls().items():
+                if options['only'] and name not in options['only']:
+                    continue
+                self.stderr.write(f'Benchmarking {name} ({handler})')
+                results[name] = self.benchmark(client, url, options['iterations'], options['warmup'])
+        return results
+
+    @staticmethod
+    def compare(results: dict) -> dict:
+        return {
+            name: {
+                'p50_ratio': round(result['latency_ms']['p50'] / wsgi['latency_ms']['p50'], 3),
+                'queries': {'wsgi': wsgi['queries'], 'asgi': result['queries']},
+            }
+            for name, result in results['asgi'].items()
+            if (wsgi := results['wsgi'].get(name)) and wsgi['latency_ms']['p50']
+        }
+
+    @staticmethod
+    def fetch(client: Client | AsyncClient, url: str) -> tuple[int, int]:
+        headers = {'User-Agent': 'shop-benchmark'}
+        if isinstance(client, AsyncClient):
+            # async_to_sync keeps thread sensitive ORM calls on this thread, inside the seeding transaction
+            response = async_to_sync(client.get)(url, headers=headers)
+        else:
+            response = client.get(url, headers=headers)
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+        return response.status_code, len(content)
+
+    def benchmark(self, client: Client | AsyncClient, url: str, iterations: int, warmup: int) -> dict:
+        for _ in range(warmup):
+            self.fetch(client, url)
+
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            status, size = self.fetch(client, url)
+            samples.append((time.perf_counter() - started) * 1000)
+
+        with CaptureQueriesContext(connection) as queries:
+            tracemalloc.start()
+            self.fetch(client, url)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        return {
+            'url': url,
+            'status': status,
+            'response_bytes': size,
+            'queries': len(queries),
+            'peak_memory_kb': round(peak / 1024, 1),
+            'latency_ms': {
+                'min': round(min(samples), 3),
+                'p50': round(percentile(samples, 50), 3),
+                'p90': round(percentile(samples, 90), 3),
+                'p99': round(percentile(samples, 99), 3),
+                'max': round(max(samples), 3),
+                'mean': round(statistics.fmean(samples), 3),
+            },
+        }
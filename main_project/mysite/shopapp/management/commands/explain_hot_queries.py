@@ -0,0 +1,126 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import QuerySet
+
+from shopapp.models import Order
+from shopapp.pagination import encode_cursor, keyset_page_queryset
+from shopapp.sitemap import ShopSitemap
+from shopapp.views import (
+    LatestProductsFeed,
+    OrdersDataExportView,
+    OrdersListView,
+    OrdersViewSet,
+    ProductDetailsView,
+    ProductsDataExportView,
+    ProductsListView,
+    ProductViewSet,
+    UserOrdersExportView,
+)
+
+SQLITE_FULL_SCAN = 'SCAN '
+SQLITE_INDEX_SCAN = ('USING INDEX', 'USING COVERING INDEX', 'USING INTEGER PRIMARY KEY')
+SQLITE_SORT = 'USE TEMP B-TREE'
+POSTGRES_FULL_SCAN = 'Seq Scan'
+POSTGRES_SORT = 'Sort'
+
+
+def api_page(viewset, **filters) -> QuerySet:
+    """
+    The first page of a viewset's list, as its keyset pagination reads it
+    """
+    pagination = viewset.pagination_class
+    ordering = (pagination.ordering,) if isinstance(pagination.ordering, str) else pagination.ordering
+    return viewset.queryset.filter(**filters).order_by(*ordering)[:pagination.page_size + 1]
+
+
+def products_list_page(deep: bool) -> QuerySet:
+    """
+    A page of ProductsListView, the first one or one after a cursor
+    """
+    view = ProductsListView
+    after = None
+    if deep:
+        first = view.queryset.order_by(*view.ordering_fields).values_list(*view.ordering_fields).first()
+        after = encode_cursor(first or ('', 0, 0))
+    return keyset_page_queryset(view.queryset.all(), view.ordering_fields, view.page_size, after=after)
+
+
+def hot_querysets(user_id: int = 1) -> list[tuple]:
+    """
+    (name, queryset, whole_table) for every hot query of the shop views, built
+    by the same code the views run. whole_table marks queries that read every
+    row by design (exports, full lists), where a full scan is expected.
+    """
+    return [
+        ('products_list', products_list_page(deep=False), False),
+        ('products_list (after cursor)', products_list_page(deep=True), False),
+        ('product_details', ProductDetailsView.model.objects.filter(pk=1), False),
+        ('products-export', ProductsDataExportView.products_queryset(), True),
+        ('product-list (api)', api_page(ProductViewSet), False),
+        ('order-list (api)', api_page(OrdersViewSet), False),
+        ('order-list (api, ?user=)', api_page(OrdersViewSet, user_id=user_id), False),
+        ('orders_list', OrdersListView.queryset, True),
+        ('orders-export', OrdersDataExportView.orders_queryset(), True),
+        ('orders-export (products)', OrdersDataExportView.links_queryset(), True),
+        ('users_orders', Order.objects.filter(user_id=user_id), False),
+        ('user_orders_export', UserOrdersExportView.orders_queryset(user_id), False),
+        ('products_feed', LatestProductsFeed().items(), False),
+        ('sitemap', ShopSitemap().items(), False),
+    ]
+
+
+def plan_issues(plan: str, vendor: str) -> list[str]:
+    issues = []
+    for line in plan.splitlines():
+        if vendor == 'sqlite':
+            if SQLITE_FULL_SCAN in line and not any(marker in line for marker in SQLITE_INDEX_SCAN):
+                issues.append(f'full scan: {line.strip()}')
+            if SQLITE_SORT in line:
+                issues.append(f'temp b-tree sort: {line.strip()}')
+        elif vendor == 'postgresql':
+            if POSTGRES_FULL_SCAN in line:
+                issues.append(f'full scan: {line.strip()}')
+            if line.strip().lstrip('->').strip().startswith(POSTGRES_SORT):
+                issues.append(f'sort: {line.strip()}')
+    return issues
+
+
+class Command(BaseCommand):
+    """
+    Runs EXPLAIN on the hot querysets of the shop views and flags full scans and sorts
+    """
+    help = 'EXPLAIN hot shop queries and flag full table scans and temporary sorts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, default=1, help='user id used by per-user queries')
+        parser.add_argument('--fail-on-issues', action='store_true', help='exit with an error if any plan is flagged')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'Plans of {vendor} are not supported')
+
+        flagged = 0
+        for name, queryset, whole_table in hot_querysets(options['user_id']):
+            plan = queryset.explain()
+            issues = plan_issues(plan, vendor)
+            # a LIMITed scan without a sort stops after the page it reads
+            bounded = queryset.query.high_mark is not None and not any('sort' in issue for issue in issues)
+            if whole_table or bounded:
+                issues = [issue for issue in issues if not issue.startswith('full scan')]
+
+            if issues:
+                flagged += 1
+                self.stdout.write(self.style.WARNING(name))
+                for issue in issues:
+                    self.stdout.write(f'    {issue}')
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name}: OK'))
+
+            if options['verbosity'] > 1:
+                self.stdout.write(f'    {queryset.query}')
+                for line in plan.splitlines():
+                    self.stdout.write(f'        {line}')
+
+        if flagged and options['fail_on_issues']:
+            raise CommandError(f'{flagged} hot queries have flagged plans')
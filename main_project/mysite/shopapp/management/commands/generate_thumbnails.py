@@ -0,0 +1,60 @@
+from concurrent.futures import wait
+
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand
+
+from shopapp.caching import (
+    PRODUCT_DETAILS_PAGES,
+    PRODUCTS_GENERATION,
+    PRODUCTS_LIST_PAGES,
+    bump_generations,
+    purge_pages,
+)
+from shopapp.models import Product, ProductImage
+from shopapp.thumbnails import generate_thumbnails, mark_thumbnails
+
+
+class Command(BaseCommand):
+    """
+    Creates missing thumbnails of product images and records them on the rows,
+    e.g. for images uploaded before thumbnails existed or after changing
+    THUMBNAIL_WIDTHS (with --force)
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Recreate existing thumbnails too')
+
+    def handle(self, *args, **options):
+        # (model, row pk, image field, image name, product id)
+        images = [
+            (Product, pk, 'preview', name, pk)
+            for pk, name in Product.objects.exclude(preview='').exclude(preview=None).values_list('pk', 'preview')
+        ]
+        images += [
+            (ProductImage, pk, 'image', name, product_id)
+            for pk, name, product_id in ProductImage.objects.exclude(image='').values_list('pk', 'image', 'product_id')
+        ]
+
+        futures, ready, missing = {}, [], 0
+        for image in images:
+            name = image[3]
+            if not default_storage.exists(name):
+                missing += 1
+                continue
+            future = generate_thumbnails(name, force=options['force'])
+            if future is None:
+                ready.append(image)
+            else:
+                futures[future] = image
+        done, _ = wait(futures)
+        failed = sum(1 for future in done if future.exception() is not None)
+        ready.extend(futures[future] for future in done if future.exception() is None)
+
+        # marked here rather than in callbacks, which may still be running when wait() returns
+        product_ids = {
+            product_id
+            for model, pk, field_name, name, product_id in ready
+            if mark_thumbnails(model, pk, field_name, name)
+        }
+        bump_generations(PRODUCTS_GENERATION)
+        purge_pages(PRODUCTS_LIST_PAGES, *(PRODUCT_DETAILS_PAGES.format(pk=pk) for pk in product_ids))
+        self.stdout.write(f'{len(futures) - failed} images resized, {failed} failed, {missing} originals missing')
@@ -0,0 +1,16 @@
+from django.core.management import BaseCommand
+
+from shopapp.search import rebuild_index, sqlite_fts_available
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the products full-text index, e.g. after bulk loads that bypass signals
+    """
+    def handle(self, *args, **options):
+        if not sqlite_fts_available():
+            self.stdout.write('No full-text index table to rebuild')
+            return
+
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Products search index rebuilt'))
@@ -0,0 +1,30 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from shopapp.caching import ORDERS_GENERATION, bump_generations, bump_user_orders_generation
+from shopapp.models import Order
+from shopapp.totals import recalculate_order_totals
+
+
+class Command(BaseCommand):
+    """
+    Recalculates Order.total_amount and items_count from the orders' products
+    and fixes the ones that drifted, e.g. after raw SQL or bulk changes
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        order_ids = list(Order.objects.order_by('pk').values_list('pk', flat=True))
+        batch_size = options['batch_size']
+        fixed = []
+        for start in range(0, len(order_ids), batch_size):
+            with transaction.atomic():
+                fixed.extend(recalculate_order_totals(order_ids[start:start + batch_size], batch_size))
+
+        if fixed:
+            bump_user_orders_generation(*{order.user_id for order in fixed})
+            bump_generations(ORDERS_GENERATION)
+        self.stdout.write(f'{len(order_ids)} orders checked, {len(fixed)} fixed')
+        for order in fixed[:20]:
+            self.stdout.write(f'  order {order.pk}: {order.total_amount} for {order.items_count} items')
@@ -0,0 +1,53 @@
+from argparse import ArgumentTypeError
+
+from django.core.management import BaseCommand
+
+from shopapp.seeding import POPULARITY_CHOICES, SeedConfig, parse_range, seed_shop
+
+
+def range_argument(value: str) -> tuple[int, int]:
+    try:
+        return parse_range(value)
+    except ValueError as exc:
+        raise ArgumentTypeError(str(exc))
+
+
+class Command(BaseCommand):
+    """
+    Generates a large synthetic shop: users, products, product images metadata,
+    orders and order-product links
+    """
+    help = 'Seed users, products, images metadata and orders in bulk for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--images-per-product', type=range_argument, default=(0, 2), help='e.g. 0-3')
+        parser.add_argument('--orders-per-user', type=range_argument, default=(0, 10), help='e.g. 1-20')
+        parser.add_argument('--products-per-order', type=range_argument, default=(1, 5), help='e.g. 1-5')
+        parser.add_argument(
+            '--popularity',
+            choices=POPULARITY_CHOICES,
+            default='uniform',
+            help='how products are picked for orders; zipf favours a few best sellers',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=0, help='processes generating rows, 0 to generate inline')
+
+    def handle(self, *args, **options):
+        config = SeedConfig(
+            users=options['users'],
+            products=options['products'],
+            images_per_product=options['images_per_product'],
+            orders_per_user=options['orders_per_user'],
+            products_per_order=options['products_per_order'],
+            popularity=options['popularity'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+        )
+        result = seed_shop(config, workers=options['workers'], progress=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result.users} users, {result.products} products, {result.images} images, '
+            f'{result.orders} orders and {result.order_products} order products'
+        ))
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            options = {row[0] for row in cursor.fetchall()}
+        if 'ENABLE_FTS5' not in options:
+            return
+        schema_editor.execute('CREATE VIRTUAL TABLE shopapp_product_fts USING fts5(name, description)')
+        schema_editor.execute(
+            'INSERT INTO shopapp_product_fts(rowid, name, description) '
+            'SELECT id, name, description FROM shopapp_product'
+        )
+
+    elif connection.vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+
+        Product = apps.get_model('shopapp', 'Product')
+        schema_editor.add_index(
+            Product,
+            GinIndex(SearchVector('name', 'description', config='simple'), name='shopapp_product_search_idx'),
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+
+    if connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS shopapp_product_fts')
+
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS shopapp_product_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0024_alter_order_options_alter_product_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:23
+
+from django.db import migrations, models
+import mysite.images
+import shopapp.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0026_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='preview_format',
+            field=models.CharField(blank=True, editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='preview_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='preview_sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='preview_size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='preview_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='format',
+            field=models.CharField(blank=True, editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='preview',
+            field=mysite.images.MetadataImageField(blank=True, format_field='preview_format', hash_field='preview_sha256', height_field='preview_height', null=True, size_field='preview_size', upload_to=shopapp.models.product_preview_directory_path, verbose_name='превью', width_field='preview_width'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=mysite.images.MetadataImageField(format_field='format', hash_field='sha256', height_field='height', size_field='size', upload_to=shopapp.models.product_images_directory_path, width_field='width'),
+        ),
+    ]
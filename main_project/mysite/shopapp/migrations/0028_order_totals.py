@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:26
+
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+
+
+def fill_order_totals(apps, schema_editor):
+    # same arithmetic as shopapp.totals.line_amount, which may change after this migration
+    Order = apps.get_model('shopapp', 'Order')
+    links = Order.products.through.objects.values_list('order_id', 'product__price', 'product__discount')
+    amounts, counts = defaultdict(Decimal), defaultdict(int)
+    for order_id, price, discount in links.iterator(chunk_size=2000):
+        amounts[order_id] += (price * (100 - (discount or 0)) / 100).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        counts[order_id] += 1
+    Order.objects.bulk_update(
+        [Order(pk=pk, total_amount=amounts[pk], items_count=counts[pk]) for pk in counts],
+        ['total_amount', 'items_count'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0027_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='количество товаров'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='сумма'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['total_amount'], name='order_total_amount_idx'),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
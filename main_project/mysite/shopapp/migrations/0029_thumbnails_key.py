@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0028_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='preview_thumbnails_key',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='image_thumbnails_key',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
@@ -1,9 +1,12 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Q
 from django.urls import reverse
 
 from django.utils.translation import gettext_lazy as _
 
+from mysite.images import MetadataImageField
+
 
 def product_preview_directory_path(instance: 'Product', filename: str) -> str:
     return 'products/product_{pk}/preview/{filename}'.format(
@@ -17,6 +20,12 @@ class Product(models.Model):
         ordering = ['name', 'price']
         verbose_name = _('product')
         verbose_name_plural = _('products')
+        indexes = [
+            # catalog list: non-archived products in Meta.ordering order
+            models.Index(fields=['name', 'price'], condition=Q(archived=False), name='product_active_name_price_idx'),
+            # sitemap: non-archived products, newest first
+            models.Index(fields=['-created_at'], condition=Q(archived=False), name='product_active_created_idx'),
+        ]
 
     name = models.CharField(max_length=100, verbose_name=_('наименование'))
     description = models.TextField(null=False, blank=True, verbose_name=_('описание'))
@@ -25,11 +34,30 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('дата создания'))
     archived = models.BooleanField(default=False, verbose_name=_('в архиве'))
     created_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name='products', null=True, verbose_name=_('создано пользователем'))
-    preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directory_path, verbose_name=_('превью'))
+    preview = MetadataImageField(
+        null=True,
+        blank=True,
+        upload_to=product_preview_directory_path,
+        verbose_name=_('превью'),
+        width_field='preview_width',
+        height_field='preview_height',
+        size_field='preview_size',
+        format_field='preview_format',
+        hash_field='preview_sha256',
+    )
+    preview_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    preview_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    preview_size = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    preview_format = models.CharField(max_length=10, blank=True, editable=False)
+    preview_sha256 = models.CharField(max_length=64, blank=True, editable=False)
+    preview_thumbnails_key = models.CharField(max_length=255, blank=True, editable=False)
 
     def __str__(self) -> str:
         return f'Product(pk={self.pk}, name={self.name!r})'
 
+    def get_absolute_url(self) -> str:
+        return reverse('shopapp:product_details', kwargs={'pk': self.pk})
+
 
 def product_images_directory_path(instance: 'ProductImage', filename: str) -> str:
     return 'products/product_{pk}/images/{filename}'.format(
@@ -40,8 +68,21 @@ def product_images_directory_path(instance: 'ProductImage', filename: str) -> st
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to=product_images_directory_path)
+    image = MetadataImageField(
+        upload_to=product_images_directory_path,
+        width_field='width',
+        height_field='height',
+        size_field='size',
+        format_field='format',
+        hash_field='sha256',
+    )
     description = models.CharField(max_length=200, null=False, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    size = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    format = models.CharField(max_length=10, blank=True, editable=False)
+    sha256 = models.CharField(max_length=64, blank=True, editable=False)
+    image_thumbnails_key = models.CharField(max_length=255, blank=True, editable=False)
 
 
 
@@ -49,6 +90,14 @@ class Order(models.Model):
     class Meta:
         verbose_name = _('Order')
         verbose_name_plural = _('Orders')
+        indexes = [
+            # user's orders by date
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+            # API keyset pagination and the feed: newest orders first
+            models.Index(fields=['-created_at', '-id'], name='order_created_idx'),
+            # filtering orders by value
+            models.Index(fields=['total_amount'], name='order_total_amount_idx'),
+        ]
 
     delivery_address = models.TextField(null=False, blank=True, verbose_name=_('адрес доставки'))
     promocode = models.CharField(max_length=20, null=False, blank=True, verbose_name=_('промокод'))
@@ -56,6 +105,9 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.PROTECT, related_name='orders', null=True, verbose_name=_('пользователь'))
     products = models.ManyToManyField(Product, related_name='orders', verbose_name=_('продукты'))
     receipt = models.FileField(null=True, upload_to='orders/receipts/', verbose_name=_('чек'))
+    # kept up to date by shopapp.totals, never set them directly
+    total_amount = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False, verbose_name=_('сумма'))
+    items_count = models.PositiveIntegerField(default=0, editable=False, verbose_name=_('количество товаров'))
 
     def get_absolute_url(self):
         return reverse('shopapp:order_details', kwargs={'pk': self.pk})
\ No newline at end of file
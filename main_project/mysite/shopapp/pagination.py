@@ -0,0 +1,158 @@
+import base64
+import json
+from typing import NamedTuple, Sequence
+
+from django.core.exceptions import ValidationError
+from django.db.models import Model, Q, QuerySet
+from django.http import Http404
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor (keyset) pagination: pages are fetched with ``WHERE key > cursor``
+    over an indexed ordering and no ``COUNT(*)``, so deep pages cost the same
+    as the first one when the ordering's leading field is indexed.
+
+    Requests with ``?page=N`` keep getting the legacy page-number response,
+    so existing clients are not broken.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    legacy_pagination_class = PageNumberPagination
+
+    def __init__(self):
+        self.legacy = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.legacy_pagination_class.page_query_param in request.query_params:
+            self.legacy = self.legacy_pagination_class()
+            page = self.legacy.paginate_queryset(queryset, request, view)
+            self.display_page_controls = getattr(self.legacy, 'display_page_controls', False)
+            return page
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_html_context(self):
+        if self.legacy is not None:
+            return self.legacy.get_html_context()
+        return super().get_html_context()
+
+
+class ProductKeysetPagination(KeysetPagination):
+    ordering = 'pk'
+
+    def get_ordering(self, request, queryset, view):
+        # search results are paged in relevance order
+        if 'search_rank' in queryset.query.annotations:
+            return ('search_rank', 'pk')
+        return super().get_ordering(request, queryset, view)
+
+
+class OrderKeysetPagination(KeysetPagination):
+    ordering = ('-created_at', '-pk')
+
+
+class KeysetPage(NamedTuple):
+    object_list: list
+    next_cursor: str | None
+    previous_cursor: str | None
+
+
+def encode_cursor(values: Sequence) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values), default=str).encode()).decode()
+
+
+def decode_cursor(cursor: str, model: type[Model], fields: Sequence[str]) -> list:
+    """
+    Values of ``fields`` from a cursor, converted and validated like the model
+    fields do, so a tampered cursor is a 404 rather than a failing query
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise Http404('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise Http404('Invalid cursor')
+    converted = []
+    for name, value in zip(fields, values):
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        try:
+            value = field.to_python(value)
+            field.run_validators(value)
+        except (ValidationError, ValueError, TypeError):
+            raise Http404('Invalid cursor')
+        # SQLite only fails on integers beyond 64 bits once the query runs
+        if value is None or isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+            raise Http404('Invalid cursor')
+        converted.append(value)
+    return converted
+
+
+def keyset_filter(fields: Sequence[str], values: Sequence, lookup: str) -> Q:
+    """
+    Rows after (lookup 'gt') or before ('lt') ``values`` in ascending ``fields`` order:
+    (a, b) > (x, y) is a >= x AND (a > x OR (a = x AND b > y)). The redundant
+    bound on the leading field lets the database search an index on it by
+    range; the OR alone makes it scan the index from the start.
+    """
+    condition = Q()
+    for index, field in enumerate(fields):
+        condition |= Q(**dict(zip(fields[:index], values)), **{f'{field}__{lookup}': values[index]})
+    return Q(**{f'{fields[0]}__{lookup}e': values[0]}) & condition
+
+
+def keyset_page_queryset(
+    queryset: QuerySet,
+    fields: Sequence[str],
+    page_size: int,
+    after: str = None,
+    before: str = None,
+) -> QuerySet:
+    """
+    The query of one page: at most page_size + 1 rows after (or, in reverse
+    order, before) the cursor
+    """
+    if before is not None:
+        return (queryset
+                .filter(keyset_filter(fields, decode_cursor(before, queryset.model, fields), 'lt'))
+                .order_by(*(f'-{field}' for field in fields))[:page_size + 1])
+    if after is not None:
+        queryset = queryset.filter(keyset_filter(fields, decode_cursor(after, queryset.model, fields), 'gt'))
+    return queryset.order_by(*fields)[:page_size + 1]
+
+
+def paginate_keyset(
+    queryset: QuerySet,
+    fields: Sequence[str],
+    page_size: int,
+    after: str = None,
+    before: str = None,
+) -> KeysetPage:
+    """
+    Keyset pagination for template views. ``fields`` must end with a unique
+    field and start with an indexed one. Each page is one query of at most
+    page_size + 1 rows that searches the index from the cursor, without OFFSET
+    or COUNT(*), so deep pages cost the same as the first one.
+    """
+    def cursor(obj) -> str:
+        return encode_cursor(getattr(obj, field) for field in fields)
+
+    rows = list(keyset_page_queryset(queryset, fields, page_size, after, before))
+    if before is not None:
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        # there is at least the row the cursor came from after this page
+        return KeysetPage(rows, cursor(rows[-1]) if rows else None, cursor(rows[0]) if has_previous else None)
+
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    return KeysetPage(
+        rows,
+        cursor(rows[-1]) if has_next else None,
+        cursor(rows[0]) if after is not None and rows else None,
+    )
@@ -0,0 +1,124 @@
+"""
+Indexed product search.
+
+On SQLite products are mirrored into the ``shopapp_product_fts`` FTS5 table
+(rowid = product pk), kept in sync by the Product signals. On PostgreSQL the
+search runs against a GIN index over the products' tsvector. Other databases,
+or SQLite builds without FTS5, fall back to DRF's ``LIKE`` based SearchFilter.
+
+Ranked querysets get a ``search_rank`` annotation where lower is better.
+"""
+import re
+from typing import Iterable
+
+from django.db import connections
+from django.db.models import FloatField, QuerySet
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+from .models import Product
+
+FTS_TABLE = 'shopapp_product_fts'
+PG_CONFIG = 'simple'
+
+_fts_tables = {}
+
+
+def sqlite_fts_available(using: str = 'default') -> bool:
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts_tables:
+        _fts_tables[name] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_tables[name]
+
+
+def search_tokens(terms: Iterable[str]) -> list[str]:
+    return re.findall(r'\w+', ' '.join(terms))
+
+
+def index_products(products: Iterable[Product], using: str = 'default') -> None:
+    if not sqlite_fts_available(using):
+        return
+    rows = [(product.pk, product.name, product.description) for product in products]
+    if not rows:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(f'INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (%s, %s, %s)', rows)
+
+
+def unindex_products(pks: Iterable[int], using: str = 'default') -> None:
+    if not sqlite_fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in pks])
+
+
+def rebuild_index(using: str = 'default') -> None:
+    if not sqlite_fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE}(rowid, name, description) '
+            f'SELECT id, name, description FROM {Product._meta.db_table}'
+        )
+
+
+def search_products(queryset: QuerySet, terms: Iterable[str]) -> QuerySet | None:
+    """
+    Filters the products matching every term (as a word prefix) and annotates
+    their rank. Returns None when no search index is available.
+    """
+    tokens = search_tokens(terms)
+    if not tokens:
+        return None
+    vendor = connections[queryset.db].vendor
+
+    if vendor == 'sqlite' and sqlite_fts_available(queryset.db):
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        table = Product._meta.db_table
+        rank = RawSQL(
+            f'SELECT bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id"',
+            (match,),
+            output_field=FloatField(),
+        )
+        matched = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+        return queryset.filter(pk__in=matched).annotate(search_rank=rank).order_by('search_rank', 'pk')
+
+    if vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        query = SearchQuery(' & '.join(f'{token}:*' for token in tokens), config=PG_CONFIG, search_type='raw')
+        return (queryset
+                .annotate(search_vector=product_search_vector())
+                .filter(search_vector=query)
+                .annotate(search_rank=SearchRank(product_search_vector(), query) * -1)
+                .order_by('search_rank', 'pk'))
+
+    return None
+
+
+def product_search_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    # Must stay identical to the expression of the index built in migration 0025
+    return SearchVector('name', 'description', config=PG_CONFIG)
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Drop-in replacement for SearchFilter on products: same ``?search=``
+    parameter, but served from the search index and ordered by relevance.
+    """
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        results = search_products(queryset, terms)
+        if results is None:
+            return super().filter_queryset(request, queryset, view)
+        return results
@@ -0,0 +1,234 @@
+"""
+Synthetic data generation for load testing.
+
+Rows are generated in chunks from a per-chunk random seed, so the data set only
+depends on the seed and the volumes, not on the number of worker processes.
+Workers only build plain tuples; the calling process assigns primary keys and
+writes them with bulk_create, one transaction per chunk.
+"""
+import random
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Callable, Iterator, NamedTuple
+
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from .caching import (
+    ORDERS_GENERATION,
+    PRODUCTS_FEED_PAGES,
+    PRODUCTS_GENERATION,
+    PRODUCTS_LIST_PAGES,
+    SITEMAP_PAGES,
+    bump_generations,
+    purge_pages,
+)
+from .models import Order, Product, ProductImage
+from .search import rebuild_index
+from .totals import recalculate_order_totals
+
+POPULARITY_CHOICES = ('uniform', 'zipf')
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+DATES_SPAN = timedelta(days=365)
+
+
+class SeedConfig(NamedTuple):
+    users: int
+    products: int
+    images_per_product: tuple[int, int] = (0, 2)
+    orders_per_user: tuple[int, int] = (0, 10)
+    products_per_order: tuple[int, int] = (1, 5)
+    popularity: str = 'uniform'
+    seed: int = 0
+    batch_size: int = 5000
+
+
+class SeedResult(NamedTuple):
+    first_user_id: int
+    first_product_id: int
+    first_order_id: int
+    users: int
+    products: int
+    images: int
+    orders: int
+    order_products: int
+
+
+def parse_range(value: str) -> tuple[int, int]:
+    """
+    '3' -> (3, 3), '1-5' -> (1, 5)
+    """
+    low, _, high = value.partition('-')
+    low, high = int(low), int(high or low)
+    if low < 0 or high < low:
+        raise ValueError(f'invalid range {value!r}')
+    return low, high
+
+
+def chunk_seed(seed: int, kind: str, index: int) -> str:
+    # str seeds are hashed with sha512 by random.Random, so they are stable across processes
+    return f'{seed}:{kind}:{index}'
+
+
+def random_date(rng: random.Random) -> datetime:
+    return EPOCH + DATES_SPAN * rng.random()
+
+
+def pick_product(rng: random.Random, products: int, popularity: str) -> int:
+    if popularity == 'zipf':
+        # log-uniform index: low indexes are picked far more often, like best sellers;
+        # random() is below 1, so the base is products + 1 to reach the last index too
+        return min(int((products + 1) ** rng.random()), products) - 1
+    return rng.randrange(products)
+
+
+def generate_products_chunk(args: tuple) -> tuple[list, list]:
+    config, index, start, stop = args
+    rng = random.Random(chunk_seed(config.seed, 'products', index))
+    products, images = [], []
+    for number in range(start, stop):
+        products.append((
+            f'Product {number}',
+            f'Synthetic product number {number}',
+            Decimal(rng.randint(100, 500000)) / 100,
+            rng.choice((0, 0, 0, 5, 10, 15)),
+            random_date(rng),
+            rng.random() < 0.1,
+        ))
+        for image in range(rng.randint(*config.images_per_product)):
+            images.append((number, image))
+    return products, images
+
+
+def generate_users_chunk(args: tuple) -> tuple[int, list, list]:
+    """
+    Orders are numbered inside the chunk; product picks are 0-based product numbers
+    """
+    config, index, start, stop = args
+    rng = random.Random(chunk_seed(config.seed, 'users', index))
+    orders, links = [], []
+    for number in range(start, stop):
+        for _ in range(rng.randint(*config.orders_per_user)):
+            orders.append((
+                number,
+                f'Synthetic street {rng.randint(1, 999)}, {number}',
+                rng.choice(('', '', '', 'SALE10', 'WELCOME')),
+                random_date(rng),
+            ))
+            if config.products:
+                wanted = min(rng.randint(*config.products_per_order), config.products)
+                picked = set()
+                while len(picked) < wanted:
+                    picked.add(pick_product(rng, config.products, config.popularity))
+                links.extend((len(orders) - 1, product) for product in sorted(picked))
+    return stop - start, orders, links
+
+
+def chunks(config: SeedConfig, total: int) -> Iterator[tuple]:
+    for index, start in enumerate(range(0, total, config.batch_size)):
+        yield config, index, start, min(start + config.batch_size, total)
+
+
+def next_pk(model) -> int:
+    return (model.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1
+
+
+@contextmanager
+def keep_created_at(*models):
+    """
+    Lets bulk_create store generated created_at values instead of auto_now_add ones
+    """
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def seed_shop(config: SeedConfig, workers: int = 0, progress: Callable[[str], None] = None) -> SeedResult:
+    progress = progress or (lambda message: None)
+    first_user_id, first_product_id, first_order_id = next_pk(User), next_pk(Product), next_pk(Order)
+    counts = {'users': 0, 'products': 0, 'images': 0, 'orders': 0, 'order_products': 0}
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    mapper = executor.map if executor else map
+    try:
+        with keep_created_at(Product, Order):
+            for products, images in mapper(generate_products_chunk, chunks(config, config.products)):
+                with transaction.atomic():
+                    first = first_product_id + counts['products']
+                    Product.objects.bulk_create([
+                        Product(
+                            pk=first + offset,
+                            name=name,
+                            description=description,
+                            price=price,
+                            discount=discount,
+                            created_at=created_at,
+                            archived=archived,
+                        )
+                        for offset, (name, description, price, discount, created_at, archived) in enumerate(products)
+                    ])
+                    ProductImage.objects.bulk_create([
+                        ProductImage(
+                            product_id=first_product_id + number,
+                            image=f'products/product_{first_product_id + number}/images/synthetic_{image}.jpg',
+                            description=f'Image {image}',
+                        )
+                        for number, image in images
+                    ])
+                counts['products'] += len(products)
+                counts['images'] += len(images)
+                progress(f'products: {counts["products"]}/{config.products}')
+
+            for users_count, orders, links in mapper(generate_users_chunk, chunks(config, config.users)):
+                with transaction.atomic():
+                    User.objects.bulk_create([
+                        User(
+                            pk=first_user_id + counts['users'] + offset,
+                            username=f'seed_user_{first_user_id + counts["users"] + offset}',
+                            password='!',
+                        )
+                        for offset in range(users_count)
+                    ])
+                    first = first_order_id + counts['orders']
+                    Order.objects.bulk_create([
+                        Order(
+                            pk=first + offset,
+                            user_id=first_user_id + number,
+                            delivery_address=address,
+                            promocode=promocode,
+                            created_at=created_at,
+                        )
+                        for offset, (number, address, promocode, created_at) in enumerate(orders)
+                    ])
+                    Order.products.through.objects.bulk_create([
+                        Order.products.through(order_id=first + order, product_id=first_product_id + product)
+                        for order, product in links
+                    ])
+                    recalculate_order_totals(range(first, first + len(orders)))
+                counts['users'] += users_count
+                counts['orders'] += len(orders)
+                counts['order_products'] += len(links)
+                progress(f'users: {counts["users"]}/{config.users}, orders: {counts["orders"]}')
+    finally:
+        if executor:
+            executor.shutdown()
+
+    # explicit primary keys leave sequences behind on databases that have them
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [User, Product, ProductImage, Order]):
+            cursor.execute(sql)
+    rebuild_index()
+    # bulk_create sends no signals
+    purge_pages(PRODUCTS_LIST_PAGES, SITEMAP_PAGES, PRODUCTS_FEED_PAGES)
+    bump_generations(PRODUCTS_GENERATION, ORDERS_GENERATION)
+
+    return SeedResult(first_user_id, first_product_id, first_order_id, **counts)
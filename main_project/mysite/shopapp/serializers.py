@@ -1,14 +1,68 @@
 from .models import Product, Order
+from .thumbnails import thumbnail_urls
 from rest_framework import serializers
 
 
 class ProductSerializer(serializers.ModelSerializer):
+    preview_thumbnails = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = (
+            'pk', 'name', 'description', 'price', 'discount', 'created_at', 'archived', 'created_by',
+            'preview', 'preview_width', 'preview_height', 'preview_size', 'preview_format', 'preview_sha256',
+            'preview_thumbnails',
+        )
+
+    def get_preview_thumbnails(self, product: Product) -> dict[str, list[dict]]:
+        thumbnails = thumbnail_urls(product.preview)
+        request = self.context.get('request')
+        if request is not None:
+            for urls in thumbnails.values():
+                for url in urls:
+                    url['url'] = request.build_absolute_uri(url['url'])
+        return thumbnails
+
+
+class ProductBulkCreateSerializer(serializers.ModelSerializer):
+    """
+    One item of a bulk create. created_by is a plain id here, bulk requests
+    check all of them with one query instead of one per item.
+    """
+    created_by = serializers.IntegerField(source='created_by_id', required=False, allow_null=True)
+
     class Meta:
         model = Product
-        fields ='pk', 'name', 'description', 'price', 'discount', 'created_at', 'archived', 'created_by', 'preview'
+        fields = 'name', 'description', 'price', 'discount', 'archived', 'created_by'
+
+
+class ProductBulkUpdateSerializer(ProductBulkCreateSerializer):
+    """
+    One item of a bulk update, validated with partial=True
+    """
+    pk = serializers.IntegerField(min_value=1)
+
+    class Meta(ProductBulkCreateSerializer.Meta):
+        fields = ('pk',) + ProductBulkCreateSerializer.Meta.fields
+
+    def validate(self, attrs):
+        if 'pk' not in attrs:
+            raise serializers.ValidationError({'pk': ['This field is required.']})
+        return attrs
 
 
 class OrdersSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields ='pk', 'delivery_address', 'promocode', 'created_at', 'user', 'products', 'receipt'
\ No newline at end of file
+        fields = (
+            'pk', 'delivery_address', 'promocode', 'created_at', 'user', 'products', 'receipt',
+            'total_amount', 'items_count',
+        )
+
+
+class OrderWithoutProductsSerializer(OrdersSerializer):
+    """
+    OrdersSerializer without the many-to-many products, for views that load product ids themselves
+    """
+    class Meta(OrdersSerializer.Meta):
+        fields = tuple(field for field in OrdersSerializer.Meta.fields if field != 'products')
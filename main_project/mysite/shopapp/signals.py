@@ -0,0 +1,182 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .caching import (
+    ORDERS_GENERATION,
+    PRODUCT_DETAILS_PAGES,
+    PRODUCTS_GENERATION,
+    PRODUCTS_FEED_PAGES,
+    PRODUCTS_LIST_PAGES,
+    SITEMAP_PAGES,
+    bump_generations,
+    bump_user_orders_generation,
+    purge_pages,
+)
+from .models import Order, Product, ProductImage
+from .search import index_products, unindex_products
+from .thumbnails import generate_thumbnails, has_thumbnails, mark_thumbnails
+from .totals import change_order_totals, line_amount, product_amounts
+
+
+def bump_on_commit(*user_ids: int) -> None:
+    transaction.on_commit(lambda: bump_user_orders_generation(*user_ids))
+    transaction.on_commit(lambda: bump_generations(ORDERS_GENERATION))
+    # the feed lists the latest orders
+    purge_pages_on_commit(PRODUCTS_FEED_PAGES)
+
+
+def purge_pages_on_commit(*groups: str) -> None:
+    transaction.on_commit(lambda: purge_pages(*groups))
+
+
+def purge_product_pages(*product_ids: int) -> None:
+    """
+    Drops what shows the products once the transaction commits; also for
+    changes made with queryset.update(), which sends no signals
+    """
+    transaction.on_commit(lambda: bump_generations(PRODUCTS_GENERATION))
+    # the feed shows product names of the latest orders
+    purge_pages_on_commit(
+        PRODUCTS_LIST_PAGES,
+        *(PRODUCT_DETAILS_PAGES.format(pk=product_id) for product_id in product_ids),
+        SITEMAP_PAGES,
+        PRODUCTS_FEED_PAGES,
+    )
+
+
+@receiver(pre_save, sender=Order)
+def remember_previous_order_state(sender, instance: Order, raw: bool = False, **kwargs):
+    instance._previous_user_id = None
+    if instance.pk is None or raw:
+        return
+    previous = (Order.objects
+                .filter(pk=instance.pk)
+                .values_list('user_id', 'total_amount', 'items_count')
+                .first())
+    if previous is not None:
+        # totals are changed with F() updates behind the instance's back, never save stale ones
+        instance._previous_user_id, instance.total_amount, instance.items_count = previous
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance: Order, **kwargs):
+    bump_on_commit(instance.user_id, getattr(instance, '_previous_user_id', None))
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance: Order, **kwargs):
+    bump_on_commit(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_changed(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    links = Order.products.through.objects
+    if not reverse:
+        # pk_set holds product ids; on post_add only the ones that weren't linked yet
+        if action == 'pre_remove':
+            # pk_set may name products that aren't in the order
+            instance._removed_product_ids = set(links
+                                                .filter(order_id=instance.pk, product_id__in=pk_set)
+                                                .values_list('product_id', flat=True))
+        elif action in ('post_add', 'post_remove'):
+            sign = 1 if action == 'post_add' else -1
+            amounts = product_amounts(pk_set if action == 'post_add' else instance._removed_product_ids)
+            change_order_totals([instance.pk], sign * sum(amounts.values(), Decimal(0)), sign * len(amounts))
+        elif action == 'post_clear':
+            Order.objects.filter(pk=instance.pk).update(total_amount=0, items_count=0)
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_on_commit(instance.user_id)
+        return
+
+    # instance is a Product, pk_set holds order ids (None on clear)
+    if action == 'pre_clear':
+        instance._cleared_orders = list(instance.orders.values_list('pk', 'user_id'))
+    elif action == 'pre_remove':
+        instance._removed_order_ids = set(links
+                                          .filter(product_id=instance.pk, order_id__in=pk_set)
+                                          .values_list('order_id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if action == 'post_clear':
+            orders = getattr(instance, '_cleared_orders', [])
+        else:
+            order_ids = pk_set if action == 'post_add' else instance._removed_order_ids
+            orders = list(Order.objects.filter(pk__in=order_ids).values_list('pk', 'user_id'))
+        sign = 1 if action == 'post_add' else -1
+        amount = product_amounts([instance.pk]).get(instance.pk, Decimal(0))
+        change_order_totals([pk for pk, _ in orders], sign * amount, sign)
+        bump_on_commit(*(user_id for _, user_id in orders))
+
+
+def update_orders_of_product(product_id: int, amount: Decimal, count: int) -> None:
+    orders = list(Order.objects.filter(products=product_id).values_list('pk', 'user_id'))
+    change_order_totals([pk for pk, _ in orders], amount, count)
+    bump_on_commit(*(user_id for _, user_id in orders))
+
+
+def thumbnails_ready(product_id: int, name: str):
+    # runs in the pool's result thread, outside any transaction
+    if mark_thumbnails(Product, product_id, 'preview', name):
+        bump_generations(PRODUCTS_GENERATION)
+        purge_pages(PRODUCTS_LIST_PAGES, PRODUCT_DETAILS_PAGES.format(pk=product_id))
+
+
+def image_thumbnails_ready(image_id: int, product_id: int, name: str):
+    if mark_thumbnails(ProductImage, image_id, 'image', name):
+        purge_pages(PRODUCT_DETAILS_PAGES.format(pk=product_id))
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_product_amount(sender, instance: Product, raw: bool = False, **kwargs):
+    instance._previous_amount = None
+    if instance.pk is not None and not raw:
+        previous = Product.objects.filter(pk=instance.pk).values_list('price', 'discount').first()
+        if previous is not None:
+            instance._previous_amount = line_amount(*previous)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance: Product, using: str, **kwargs):
+    index_products([instance], using=using)
+    purge_product_pages(instance.pk)
+    previous_amount = getattr(instance, '_previous_amount', None)
+    if previous_amount is not None:
+        delta = line_amount(instance.price, instance.discount) - previous_amount
+        if delta:
+            update_orders_of_product(instance.pk, delta, 0)
+    if instance.preview and not has_thumbnails(instance.preview):
+        name, pk = instance.preview.name, instance.pk
+        transaction.on_commit(lambda: generate_thumbnails(name, on_done=lambda: thumbnails_ready(pk, name)))
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance: Product, **kwargs):
+    # the product's order links are deleted without m2m_changed
+    amount = product_amounts([instance.pk]).get(instance.pk)
+    if amount is not None:
+        update_orders_of_product(instance.pk, -amount, -1)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance: Product, using: str, **kwargs):
+    unindex_products([instance.pk], using=using)
+    purge_product_pages(instance.pk)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance: ProductImage, **kwargs):
+    purge_pages_on_commit(PRODUCT_DETAILS_PAGES.format(pk=instance.product_id))
+
+
+@receiver(post_save, sender=ProductImage)
+def product_image_saved(sender, instance: ProductImage, **kwargs):
+    if not instance.image or has_thumbnails(instance.image):
+        return
+    name, pk, product_id = instance.image.name, instance.pk, instance.product_id
+    transaction.on_commit(lambda: generate_thumbnails(
+        name,
+        on_done=lambda: image_thumbnails_ready(pk, product_id, name),
+    ))
@@ -0,0 +1,59 @@
+from itertools import islice
+from typing import Iterable, Iterator
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+encoder = DjangoJSONEncoder()
+
+
+def batched(rows: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(rows)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_json_array(rows: Iterable[dict], key: str, chunk_size: int) -> Iterator[str]:
+    """
+    Yields ``{"<key>": [row, row, ...]}`` piece by piece, one chunk of rows at a time
+    """
+    yield '{%s: [' % encoder.encode(key)
+    separator = ''
+    for batch in batched(rows, chunk_size):
+        yield separator + ', '.join(encoder.encode(row) for row in batch)
+        separator = ', '
+    yield ']}'
+
+
+def iter_ndjson(rows: Iterable[dict], chunk_size: int) -> Iterator[str]:
+    """
+    Yields one JSON document per line, one chunk of rows at a time
+    """
+    for batch in batched(rows, chunk_size):
+        yield ''.join(encoder.encode(row) + '\n' for row in batch)
+
+
+def unknown_format_response() -> HttpResponseBadRequest:
+    # the requested format is not echoed back, it would be reflected into the page
+    return HttpResponseBadRequest(
+        'Unknown export format, use one of: {}'.format(', '.join(EXPORT_FORMATS)),
+        content_type='text/plain; charset=utf-8',
+    )
+
+
+def streaming_export_response(
+    rows: Iterable[dict],
+    key: str,
+    export_format: str,
+    chunk_size: int,
+) -> StreamingHttpResponse:
+    if export_format == 'ndjson':
+        content = iter_ndjson(rows, chunk_size)
+    else:
+        content = iter_json_array(rows, key, chunk_size)
+    return StreamingHttpResponse(content, content_type=EXPORT_FORMATS[export_format])
@@ -0,0 +1,37 @@
+from django import template
+from django.db.models.fields.files import FieldFile
+from django.utils.html import format_html, format_html_join
+
+from shopapp.thumbnails import FORMATS, has_thumbnails, srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture(image: FieldFile, sizes: str = '100vw', alt: str = None) -> str:
+    """
+    <picture> with a WebP and a JPEG srcset of the image's thumbnails, or a
+    plain <img> of the original while they aren't ready. The intrinsic size
+    comes from the stored metadata of MetadataImageField, never from the file,
+    and whether the thumbnails are ready from the row too.
+    """
+    if not image:
+        return ''
+    size = ''
+    width = getattr(image.instance, image.field.width_field or '', None)
+    height = getattr(image.instance, image.field.height_field or '', None)
+    if width and height:
+        size = format_html(' width="{}" height="{}"', width, height)
+    img = format_html(
+        '<img src="{}" alt="{}"{} loading="lazy">',
+        image.url,
+        image.name if alt is None else alt,
+        size,
+    )
+    if not has_thumbnails(image):
+        return img
+    sources = format_html_join('', '<source type="{}" srcset="{}" sizes="{}">', (
+        (content_type, srcset(image.name, extension), sizes)
+        for extension, (content_type, _, _) in FORMATS.items()
+    ))
+    return format_html('<picture>{}{}</picture>', sources, img)
@@ -1,15 +1,49 @@
+import csv
+import hashlib
+import json
+import multiprocessing
+import random
+import shutil
+import tempfile
+import time
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from PIL import Image
+
 from django.conf import settings
+from django.contrib import admin
 from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.contrib.auth.models import User, Permission
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.core.cache import cache, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import translation
 from string import ascii_letters
 from random import choices
 from django.conf import settings
 
-from shopapp.models import Product, Order
+from mysite.cache import LockingFileBasedCache, get_or_compute
+from shopapp.admin import ProductAdmin, mark_archived
+from shopapp.caching import PRODUCTS_GENERATION
+from shopapp.importers import import_orders_csv
+from shopapp.models import Product, Order, ProductImage
+from shopapp.pagination import encode_cursor, keyset_page_queryset
+from shopapp.seeding import SeedConfig, pick_product, seed_shop
+from shopapp.thumbnails import has_thumbnails, mark_thumbnails, thumbnail_name
+from shopapp.totals import line_amount, recalculate_order_totals
 from shopapp.utils import add_two_numbers
+from shopapp.views import ProductsListView
 
 class AddTWoNumbersTestCase(TestCase):
     def test_add_two_numbers(self):
@@ -59,6 +93,9 @@ class ProductsListViewTestCase(TestCase):
         'products-fixture.json',
     ]
 
+    def setUp(self):
+        cache.clear()
+
     def test_products(self):
         response = self.client.get(reverse('shopapp:products_list'))
 
@@ -70,6 +107,67 @@ class ProductsListViewTestCase(TestCase):
         self.assertTemplateUsed(response, 'shopapp/products-list.html')
 
 
+class ProductsListPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # repeated names and prices, so pages break inside ties
+        Product.objects.bulk_create([
+            Product(name=f'Paged product {index // 3}', price=index % 2, archived=index % 7 == 0)
+            for index in range(50)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def get_page(self, **params):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('shopapp:products_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_pages_cover_catalog_in_order(self):
+        expected = list(Product.objects.filter(archived=False).order_by('name', 'price', 'pk').values_list('pk', flat=True))
+
+        pages = [self.get_page()]
+        while pages[-1].context['next_cursor']:
+            pages.append(self.get_page(after=pages[-1].context['next_cursor']))
+        self.assertEqual([p.pk for page in pages for p in page.context['products']], expected)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0].context['previous_cursor'])
+
+        response = self.get_page(before=pages[-1].context['previous_cursor'])
+        self.assertEqual(list(response.context['products']), list(pages[-2].context['products']))
+
+    def test_product_cards_are_cached(self):
+        response = self.get_page()
+        product = response.context['products'][0]
+        key = make_template_fragment_key('product_card', [product.pk, product.card_version, 'en'])
+        self.assertIn(product.name, cache.get(key))
+
+    def test_deep_pages_search_the_index(self):
+        cursor = encode_cursor(['Paged product 8', '1.00', 25])
+        for direction in ('after', 'before'):
+            with self.subTest(direction=direction):
+                queryset = keyset_page_queryset(
+                    ProductsListView.queryset,
+                    ProductsListView.ordering_fields,
+                    ProductsListView.page_size,
+                    **{direction: cursor},
+                )
+                self.assertRegex(queryset.explain(), r'SEARCH shopapp_product USING INDEX product_active_name_price_idx \(name[<>]\?\)')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('shopapp:products_list'), {'after': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursor(self):
+        for values in (['a', '1', 'x'], ['a', {'x': 1}, 1], ['a', '1', 2 ** 70], ['a', None, 1], ['a', '1']):
+            for direction in ('after', 'before'):
+                with self.subTest(values=values, direction=direction):
+                    response = self.client.get(reverse('shopapp:products_list'), {direction: encode_cursor(values)})
+                    self.assertEqual(response.status_code, 404)
+
+
 class OrdersListViewTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -129,12 +227,28 @@ class ProductsExportViewTestCase(TestCase):
             }
             for product in products
         ]
-        products_data = response.json()
+        products_data = json.loads(b''.join(response.streaming_content))
         self.assertEqual(
             products_data['products'],
             expected_data
         )
 
+    def test_get_products_view_ndjson(self):
+        response = self.client.get(reverse('shopapp:products-export'), {'format': 'ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)['pk'] for line in lines],
+            list(Product.objects.order_by('pk').values_list('pk', flat=True)),
+        )
+
+    def test_get_products_view_unknown_format(self):
+        response = self.client.get(reverse('shopapp:products-export'), {'format': '<script>alert(1)</script>'})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.headers['content-type'].startswith('text/plain'))
+        self.assertNotContains(response, '<script>', status_code=400)
+
 
 class OrderDetailViewTestCase(PermissionRequiredMixin, TestCase):
     @classmethod
@@ -205,12 +319,779 @@ class OrdersExportTestCase(PermissionRequiredMixin, TestCase):
                 'address': order.delivery_address,
                 'promocode': order.promocode,
                 'user_is': str(order.user),
-                'products': str(order.products.all())
+                'products': sorted(product.pk for product in order.products.all()),
+                'total_amount': str(sum(line_amount(product.price, product.discount) for product in order.products.all())),
+                'items_count': order.products.count(),
             }
             for order in orders
         ]
-        orders_data = response.json()
+        orders_data = json.loads(b''.join(response.streaming_content))
         self.assertEqual(
             orders_data['orders'],
             expected_data
-        )
\ No newline at end of file
+        )
+
+    def test_order_export_view_unknown_format(self):
+        response = self.client.get(reverse('shopapp:orders-export'), {'format': '<img src=x onerror=alert(1)>'})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.headers['content-type'].startswith('text/plain'))
+        self.assertNotContains(response, '<img', status_code=400)
+
+    def test_order_export_view_query_count(self):
+        response = self.client.get(reverse('shopapp:orders-export'))
+        with self.assertNumQueries(2):
+            b''.join(response.streaming_content)
+
+
+class UserOrdersExportViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='export_test', password='qwerty')
+        cls.product = Product.objects.create(name='Cached product')
+
+    def setUp(self):
+        # cached exports outlive the rollback of each test's database changes
+        cache.clear()
+
+    def get_orders(self):
+        response = self.client.get(
+            reverse('shopapp:user_orders_export', kwargs={'user_id': self.user.pk}),
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['orders']
+
+    def test_export_is_refreshed_on_order_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.user, delivery_address='first')
+        self.assertEqual([o['delivery_address'] for o in self.get_orders()], ['first'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.products.add(self.product)
+        self.assertEqual(self.get_orders()[0]['products'], [self.product.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delivery_address = 'second'
+            order.save()
+        self.assertEqual(self.get_orders()[0]['delivery_address'], 'second')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delete()
+        self.assertEqual(self.get_orders(), [])
+
+    def test_export_is_served_from_cache(self):
+        self.get_orders()
+        # the conditional GET validators and the owner lookup
+        with self.assertNumQueries(2):
+            self.get_orders()
+
+
+class ConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='conditional_test', is_staff=True)
+        cls.product = Product.objects.create(name='Conditional product', price=10)
+        cls.order = Order.objects.create(user=cls.user, delivery_address='conditional')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.urls = [
+            reverse('shopapp:products-export'),
+            reverse('shopapp:orders-export'),
+            reverse('shopapp:product-list'),
+            reverse('shopapp:user_orders_export', kwargs={'user_id': self.user.pk}),
+        ]
+
+    def test_unchanged_data_is_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Last-Modified', response.headers)
+                # session, user and the validators
+                with self.assertNumQueries(3):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_changes_update_etag(self):
+        etags = [self.client.get(url).headers['ETag'] for url in self.urls]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 20
+            self.product.save()
+            self.order.products.add(self.product)
+
+        for url, etag in zip(self.urls, etags):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response.headers['ETag'], etag)
+
+
+    def test_admin_archive_updates_etag(self):
+        with translation.override('en'):
+            url = reverse('shopapp:products-export')
+        etag = self.client.get(url).headers['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_archived(None, None, Product.objects.filter(pk=self.product.pk))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        products = json.loads(b''.join(response.streaming_content))['products']
+        self.assertEqual([product['archived'] for product in products], [True])
+
+
+TIERED_CACHES = {
+    'default': {
+        'BACKEND': 'mysite.cache.TieredCache',
+        'LOCATION': 'tiered-test',
+        'OPTIONS': {'L2': 'shared', 'L1_MAX_ENTRIES': 2, 'L1_TIMEOUT': 60},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tiered-test-shared',
+    },
+}
+
+
+@override_settings(CACHES=TIERED_CACHES)
+class TieredCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_l1_serves_reads_and_evicts_least_recently_used(self):
+        shared = caches['shared']
+        cache.set('a', [1])
+        cache.set('b', 2)
+        self.assertEqual(shared.get('a'), [1])
+
+        shared.set('a', 'changed elsewhere')
+        value = cache.get('a')
+        self.assertEqual(value, [1])
+        value.append(2)
+        self.assertEqual(cache.get('a'), [1])
+
+        cache.set('c', 3)
+        shared.set('b', 'changed elsewhere')
+        self.assertEqual(cache.get('b'), 'changed elsewhere')
+
+        cache.delete('a')
+        self.assertIsNone(shared.get('a'))
+        self.assertIsNone(cache.get('a'))
+
+    def test_get_or_compute_single_flight(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return 'fresh'
+
+        self.assertEqual(get_or_compute('report', compute, timeout=60), 'fresh')
+        self.assertEqual(get_or_compute('report', compute, timeout=60), 'fresh')
+        self.assertEqual(len(calls), 1)
+
+        # somebody else is recomputing: the stale value is served
+        cache.set('report', ('stale', 0.0, 0.0), 60)
+        cache.add('report:lock', 'other worker', 60)
+        self.assertEqual(get_or_compute('report', compute, timeout=60), 'stale')
+        self.assertEqual(len(calls), 1)
+
+        cache.delete('report:lock')
+        self.assertEqual(get_or_compute('report', compute, timeout=60), 'fresh')
+        self.assertEqual(len(calls), 2)
+
+    def test_get_or_compute_recomputes_early_when_compute_is_slow(self):
+        # expires in 1 second, but took 1000 seconds to compute: recomputed right away
+        cache.set('slow', ('old', 1000.0, time.time() + 1), 60)
+        self.assertEqual(get_or_compute('slow', lambda: 'new', timeout=60), 'new')
+
+
+class TestIsolationTestCase(TestCase):
+    def test_suite_runs_on_its_own_caches_and_metrics_dir(self):
+        # cache.clear() in tests must never reach the caches of a running site
+        self.assertEqual(settings.CACHES['shared']['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache')
+        self.assertTrue(settings.METRICS_DIR.parent.name.startswith('mysite-tests-'))
+
+
+def count_in_file_cache(location: str, hits: int) -> int:
+    cache = LockingFileBasedCache(location, {})
+    won = int(cache.add('lock', 'mine', 60))
+    for _ in range(hits):
+        cache.incr('counter')
+    return won
+
+
+class LockingFileBasedCacheTestCase(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+
+    def test_add_and_incr_are_atomic_between_processes(self):
+        LockingFileBasedCache(self.location, {}).set('counter', 0, 60)
+        with multiprocessing.get_context('fork').Pool(4) as pool:
+            won = pool.starmap(count_in_file_cache, [(self.location, 50)] * 4)
+
+        cache = LockingFileBasedCache(self.location, {})
+        self.assertEqual(sum(won), 1)
+        self.assertEqual(cache.get('counter'), 200)
+        # lock files live outside the cache files, clear() leaves them alone
+        cache.clear()
+        self.assertIsNone(cache.get('counter'))
+        self.assertTrue(cache.add('lock', 'again', 60))
+
+
+class PublicPageCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Page cached product', price=10)
+        cls.other = Product.objects.create(name='Other page cached product', price=20)
+
+    def setUp(self):
+        cache.clear()
+
+    def url(self, name, language='en', **kwargs):
+        with translation.override(language):
+            return reverse(name, kwargs=kwargs)
+
+    def test_anonymous_pages_are_cached_per_language(self):
+        for name, kwargs in (('shopapp:products_list', {}), ('shopapp:product_details', {'pk': self.product.pk})):
+            with self.subTest(name=name):
+                url = self.url(name, **kwargs)
+                self.assertContains(self.client.get(url), 'Page cached product')
+                with self.assertNumQueries(0):
+                    self.assertContains(self.client.get(url), 'Page cached product')
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(self.url(name, language='de', **kwargs))
+                self.assertTrue(queries)
+
+    def test_product_changes_purge_affected_pages(self):
+        list_url = self.url('shopapp:products_list')
+        details_url = self.url('shopapp:product_details', pk=self.product.pk)
+        other_url = self.url('shopapp:product_details', pk=self.other.pk)
+        for url in (list_url, details_url, other_url, '/sitemap.xml'):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Renamed page cached product'
+            self.product.save()
+
+        self.assertContains(self.client.get(list_url), 'Renamed page cached product')
+        self.assertContains(self.client.get(details_url), 'Renamed page cached product')
+        with self.assertNumQueries(0):
+            self.client.get(other_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.archived = True
+            self.product.save()
+        self.assertNotContains(self.client.get('/sitemap.xml'), f'/products/{self.product.pk}/')
+        self.assertContains(self.client.get('/sitemap.xml'), f'/products/{self.other.pk}/')
+
+    def test_admin_archive_purges_pages(self):
+        list_url = self.url('shopapp:products_list')
+        details_url = self.url('shopapp:product_details', pk=self.product.pk)
+        for url in (list_url, details_url, '/sitemap.xml'):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_archived(None, None, Product.objects.filter(pk=self.product.pk))
+
+        self.assertNotContains(self.client.get(list_url), f'Name: {self.product.name}<')
+        self.assertNotContains(self.client.get('/sitemap.xml'), f'/products/{self.product.pk}/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(details_url)
+        self.assertTrue(queries)
+
+    def test_authenticated_users_are_not_served_from_cache(self):
+        url = self.url('shopapp:products_list')
+        self.client.get(url)
+
+        self.client.force_login(User.objects.create_user(username='page_cache_user'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(name='Silently renamed product')
+        self.assertContains(self.client.get(url), 'Silently renamed product')
+
+
+def png_upload(name: str, size: tuple[int, int]) -> SimpleUploadedFile:
+    content = BytesIO()
+    Image.new('RGBA', size, (200, 20, 20, 128)).save(content, 'PNG')
+    return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
+
+
+class ThumbnailsTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root, THUMBNAIL_WORKERS=0, THUMBNAIL_WIDTHS=(100, 400))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.product = Product.objects.create(name='Pictured product')
+
+    def test_uploads_get_resized_derivatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.preview = png_upload('preview.png', (300, 150))
+            self.product.save()
+            ProductImage.objects.create(product=self.product, image=png_upload('image.png', (50, 50)))
+
+        self.product.refresh_from_db()
+        preview = self.product.preview.name
+        self.assertTrue(has_thumbnails(self.product.preview))
+        for width, expected in ((100, (100, 50)), (400, (300, 150))):
+            for extension, image_format in (('webp', 'WEBP'), ('jpg', 'JPEG')):
+                with Image.open(default_storage.path(thumbnail_name(preview, width, extension))) as thumbnail:
+                    self.assertEqual((thumbnail.format, thumbnail.size), (image_format, expected))
+        self.assertTrue(has_thumbnails(self.product.images.get().image))
+
+        # the rows say the thumbnails are ready, the storage isn't asked
+        with mock.patch.object(type(default_storage._wrapped), 'exists', side_effect=AssertionError):
+            response = self.client.get(reverse('shopapp:product_details', kwargs={'pk': self.product.pk}))
+        self.assertContains(response, f'srcset="{default_storage.url(thumbnail_name(preview, 100, "webp"))} 100w, ', count=1)
+        self.assertContains(response, '<source type="image/jpeg"', count=2)
+
+        data = self.client.get(reverse('shopapp:product-detail', kwargs={'pk': self.product.pk})).json()
+        self.assertEqual([url['width'] for url in data['preview_thumbnails']['webp']], [100, 400])
+
+    def test_original_is_served_until_thumbnails_exist(self):
+        self.product.preview = png_upload('preview.png', (300, 150))
+        self.product.save()
+
+        response = self.client.get(reverse('shopapp:product_details', kwargs={'pk': self.product.pk}))
+        self.assertContains(response, f'<img src="{self.product.preview.url}"')
+        self.assertNotContains(response, '<picture>')
+
+        call_command('generate_thumbnails', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertTrue(has_thumbnails(self.product.preview))
+        response = self.client.get(reverse('shopapp:product_details', kwargs={'pk': self.product.pk}))
+        self.assertContains(response, '<picture>')
+
+    def test_replaced_image_falls_back_to_the_original(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.preview = png_upload('preview.png', (300, 150))
+            self.product.save()
+        self.product.refresh_from_db()
+        old_preview = self.product.preview.name
+
+        self.product.preview = png_upload('replaced.png', (200, 100))
+        self.product.save()
+        self.assertFalse(has_thumbnails(self.product.preview))
+        # a late callback for the old image doesn't mark the new one
+        self.assertFalse(mark_thumbnails(Product, self.product.pk, 'preview', old_preview))
+        response = self.client.get(reverse('shopapp:product_details', kwargs={'pk': self.product.pk}))
+        self.assertNotContains(response, '<picture>')
+
+        with self.settings(THUMBNAIL_WIDTHS=(100, 200)):
+            self.assertFalse(has_thumbnails(Product.objects.get(pk=self.product.pk).preview))
+
+
+class ImageMetadataTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root, THUMBNAIL_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.product = Product.objects.create(name='Measured product')
+
+    def upload_preview(self):
+        upload = png_upload('preview.png', (120, 80))
+        content = upload.read()
+        self.product.preview = upload
+        self.product.save()
+        return content
+
+    def test_metadata_is_stored_on_upload(self):
+        content = self.upload_preview()
+        image = ProductImage.objects.create(product=self.product, image=png_upload('image.png', (30, 40)))
+
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(
+            (product.preview_width, product.preview_height, product.preview_size, product.preview_format, product.preview_sha256),
+            (120, 80, len(content), 'PNG', hashlib.sha256(content).hexdigest()),
+        )
+        self.assertEqual((image.width, image.height, image.format), (30, 40, 'PNG'))
+
+        # nothing reads the file once the metadata is stored
+        default_storage.delete(product.preview.name)
+        response = self.client.get(reverse('shopapp:product_details', kwargs={'pk': product.pk}))
+        self.assertContains(response, 'width="120" height="80"')
+        data = self.client.get(reverse('shopapp:product-detail', kwargs={'pk': product.pk})).json()
+        self.assertEqual((data['preview_width'], data['preview_format']), (120, 'PNG'))
+
+    def test_metadata_follows_an_assigned_stored_file(self):
+        self.upload_preview()
+        other = ProductImage.objects.create(product=self.product, image=png_upload('other.png', (30, 40)))
+
+        product = Product.objects.get(pk=self.product.pk)
+        product.preview = other.image.name
+        product.save()
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.preview_width, product.preview_height, product.preview_sha256), (30, 40, other.sha256))
+
+        # saving again, or with the image deferred, doesn't open the file
+        default_storage.delete(other.image.name)
+        product.name = 'Measured product, renamed'
+        product.save()
+        Product.objects.only('pk', 'name').get(pk=product.pk).save()
+        self.assertEqual(Product.objects.get(pk=product.pk).preview_width, 30)
+
+    def test_backfill_command(self):
+        self.upload_preview()
+        Product.objects.filter(pk=self.product.pk).update(preview_width=None, preview_height=None, preview_sha256='')
+        broken = Product.objects.create(name='Broken preview', preview='products/missing.png')
+
+        stderr = StringIO()
+        call_command('backfill_image_metadata', stdout=StringIO(), stderr=stderr)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.preview_width, self.product.preview_height), (120, 80))
+        self.assertEqual(len(self.product.preview_sha256), 64)
+        self.assertIn(f'shopapp.Product {broken.pk}', stderr.getvalue())
+
+
+class OrderTotalsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='totals_test')
+        cls.laptop = Product.objects.create(name='Totals laptop', price='1000.00', discount=15)
+        cls.mouse = Product.objects.create(name='Totals mouse', price='19.99', discount=0)
+        cls.cable = Product.objects.create(name='Totals cable', price='3.35', discount=50)
+
+    def totals(self, order: Order) -> tuple[str, int]:
+        order.refresh_from_db()
+        return str(order.total_amount), order.items_count
+
+    def test_totals_follow_order_products(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.laptop, self.mouse)
+        self.assertEqual(self.totals(order), ('869.99', 2))
+
+        order.products.add(self.mouse, self.cable)
+        self.assertEqual(self.totals(order), ('871.67', 3))
+
+        order.products.remove(self.laptop, self.laptop)
+        self.assertEqual(self.totals(order), ('21.67', 2))
+
+        self.cable.orders.remove(order)
+        self.mouse.orders.add(Order.objects.create(user=self.user))
+        self.assertEqual(self.totals(order), ('19.99', 1))
+
+        order.products.clear()
+        self.assertEqual(self.totals(order), ('0.00', 0))
+
+    def test_totals_follow_product_changes(self):
+        first, second = Order.objects.create(user=self.user), Order.objects.create(user=self.user)
+        first.products.add(self.laptop, self.cable)
+        second.products.add(self.laptop)
+
+        self.laptop.discount = 0
+        self.laptop.save()
+        self.assertEqual(self.totals(first), ('1001.68', 2))
+        self.assertEqual(self.totals(second), ('1000.00', 1))
+
+        # saving a stale instance keeps the stored totals
+        first.delivery_address = 'Saved later'
+        first.save()
+        self.cable.delete()
+        self.assertEqual(self.totals(first), ('1000.00', 1))
+
+    def test_orders_api_filters_by_total(self):
+        cheap, expensive = Order.objects.create(user=self.user), Order.objects.create(user=self.user)
+        cheap.products.add(self.cable)
+        expensive.products.add(self.laptop)
+
+        response = self.client.get(reverse('shopapp:order-list'), {'total_amount__gte': 100})
+        self.assertEqual([order['pk'] for order in response.json()['results']], [expensive.pk])
+        self.assertEqual(response.json()['results'][0]['total_amount'], '850.00')
+
+    def test_incremental_totals_stay_exact(self):
+        dime = Product.objects.create(name='Totals dime', price='0.10')
+        fifth = Product.objects.create(name='Totals fifth', price='0.20')
+        order = Order.objects.create(user=self.user)
+        order.products.add(dime)
+        order.products.add(fifth, self.mouse)
+        order.products.remove(self.mouse)
+
+        for lookup in ('total_amount', 'total_amount__gte', 'total_amount__lte'):
+            with self.subTest(lookup=lookup):
+                self.assertQuerysetEqual(Order.objects.filter(**{lookup: Decimal('0.30')}), [order])
+        self.assertEqual(recalculate_order_totals([order.pk]), [])
+
+    def test_reconcile_command(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.laptop, self.mouse)
+        Order.objects.filter(pk=order.pk).update(total_amount=0, items_count=7)
+        # off by float noise only, which reads back as the right amount
+        noisy = Order.objects.create(user=self.user)
+        noisy.products.add(self.mouse)
+        Order.objects.filter(pk=noisy.pk).update(total_amount=F('total_amount') + 1e-9)
+
+        stdout = StringIO()
+        call_command('reconcile_order_totals', stdout=stdout)
+        self.assertIn('2 fixed', stdout.getvalue())
+        self.assertEqual(self.totals(order), ('869.99', 2))
+        self.assertEqual(recalculate_order_totals([noisy.pk]), [])
+
+
+class ImportOrdersCSVTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='csv_test', password='qwerty')
+        cls.products = [Product.objects.create(name=f'CSV product {i}') for i in range(2)]
+
+    def test_import_orders(self):
+        first, second = self.products
+        csv_file = StringIO(
+            'delivery_address,promocode,user,products\n'
+            f'"Home",SALE,{self.user.pk},{first.pk}.{second.pk}\n'
+            f'"Work",,{self.user.pk},{second.pk}\n'
+            f'"Nowhere",,{self.user.pk + 1000},{first.pk}\n'
+            f'"Broken",,abc,{first.pk}\n'
+        )
+        with self.assertNumQueries(6):
+            report = import_orders_csv(csv_file, batch_size=10)
+
+        self.assertEqual(report.imported, 2)
+        self.assertEqual([error.line for error in report.errors], [4, 5])
+        orders = Order.objects.filter(user=self.user).order_by('pk')
+        self.assertEqual([order.delivery_address for order in orders], ['Home', 'Work'])
+        self.assertQuerysetEqual(orders[0].products.order_by('pk'), [first, second])
+        self.assertQuerysetEqual(orders[1].products.all(), [second])
+
+
+class ExportAsCSVMixinTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username=f'csv_author_{i}') for i in range(2)]
+        for i in range(5):
+            Product.objects.create(name=f'Exported {i}', created_by=cls.users[i % 2])
+
+    def test_export_csv_streams_rows_with_related_names(self):
+        model_admin = ProductAdmin(Product, admin.site)
+        model_admin.export_chunk_size = 2
+        response = model_admin.export_csv(None, Product.objects.order_by('pk'))
+
+        with self.assertNumQueries(4):
+            content = b''.join(response.streaming_content).decode()
+
+        header, *rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(header, [field.name for field in Product._meta.fields])
+        created_by = header.index('created_by')
+        self.assertEqual(
+            [row[created_by] for row in rows],
+            [str(product.created_by) for product in Product.objects.order_by('pk')],
+        )
+
+
+class KeysetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [Product.objects.create(name=f'Paged {i}') for i in range(15)]
+
+    def test_products_are_paged_by_cursor(self):
+        response = self.client.get(reverse('shopapp:product-list'), HTTP_USER_AGENT='Mozilla/5.0')
+        first_page = response.json()
+        self.assertNotIn('count', first_page)
+        self.assertEqual([p['pk'] for p in first_page['results']], [p.pk for p in self.products[:10]])
+
+        response = self.client.get(first_page['next'], HTTP_USER_AGENT='Mozilla/5.0')
+        second_page = response.json()
+        self.assertEqual([p['pk'] for p in second_page['results']], [p.pk for p in self.products[10:]])
+        self.assertIsNone(second_page['next'])
+
+    def test_page_number_is_still_supported(self):
+        response = self.client.get(reverse('shopapp:product-list'), {'page': 2}, HTTP_USER_AGENT='Mozilla/5.0')
+        data = response.json()
+        self.assertEqual(data['count'], 15)
+        self.assertEqual(
+            [p['pk'] for p in data['results']],
+            list(Product.objects.values_list('pk', flat=True))[10:],
+        )
+
+
+class ProductSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptop = Product.objects.create(name='Zorblax laptop', description='Fast and loud')
+        cls.bag = Product.objects.create(name='Bag', description='Fits any zorblax')
+        cls.phone = Product.objects.create(name='Phone', description='Small')
+
+    def search(self, term):
+        response = self.client.get(reverse('shopapp:product-list'), {'search': term}, HTTP_USER_AGENT='Mozilla/5.0')
+        return [product['pk'] for product in response.json()['results']]
+
+    def test_search_is_ranked_by_relevance(self):
+        self.assertEqual(self.search('zorbl'), [self.laptop.pk, self.bag.pk])
+        self.assertEqual(self.search('zorblax fits'), [self.bag.pk])
+
+    def test_index_follows_product_changes(self):
+        self.phone.name = 'Zorblax stand'
+        self.phone.save()
+        self.assertIn(self.phone.pk, self.search('zorblax'))
+
+        self.laptop.delete()
+        self.assertNotIn(self.laptop.pk, self.search('zorblax'))
+
+
+class ProductBulkApiTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='bulk_test')
+        cls.product = Product.objects.create(name='Bulk existing', price=10)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('shopapp:product-bulk')
+
+    def send(self, method, items):
+        return getattr(self.client, method)(self.url, json.dumps(items), content_type='application/json')
+
+    def search(self, term):
+        response = self.client.get(reverse('shopapp:product-list'), {'search': term})
+        return [product['pk'] for product in response.json()['results']]
+
+    def test_bulk_create(self):
+        items = [{'name': f'Bulk quokka {index}', 'price': index, 'created_by': self.user.pk} for index in range(30)]
+        # users check, insert, search index delete and insert, savepoint and its release
+        with self.assertNumQueries(6):
+            response = self.send('post', items)
+        self.assertEqual(response.status_code, 201)
+        pks = [result['pk'] for result in response.json()]
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=pks).order_by('pk').values_list('name', 'created_by')),
+            [(item['name'], self.user.pk) for item in items],
+        )
+        self.assertEqual(len(self.search('quokka')), 10)
+
+    def test_bulk_create_reports_invalid_items(self):
+        response = self.send('post', [{'name': 'Valid bulk'}, {'price': 1}, {'name': 'Bad user', 'created_by': 10 ** 6}])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()], ['created', 'invalid', 'invalid'])
+        self.assertIn('name', response.json()[1]['errors'])
+        self.assertIn('created_by', response.json()[2]['errors'])
+        self.assertFalse(Product.objects.filter(name='Bad user').exists())
+
+    def test_bulk_update(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.product)
+        list_url = reverse('shopapp:product-list')
+        etag = self.client.get(list_url).headers['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.send('patch', [
+                {'pk': self.product.pk, 'name': 'Bulk wombat', 'price': '12.50'},
+                {'pk': 10 ** 6, 'name': 'Missing'},
+                {'name': 'No pk'},
+            ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()], ['updated', 'invalid', 'invalid'])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, str(self.product.price)), ('Bulk wombat', '12.50'))
+        self.assertEqual(self.search('wombat'), [self.product.pk])
+        order.refresh_from_db()
+        self.assertEqual(str(order.total_amount), '12.50')
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_bulk_requires_list(self):
+        self.assertEqual(self.send('post', {'name': 'Not a list'}).status_code, 400)
+
+
+class ExplainHotQueriesTestCase(TestCase):
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_hot_queries', '--fail-on-issues', stdout=out)
+        self.assertIn('products_list: OK', out.getvalue())
+        self.assertIn('products_list (after cursor): OK', out.getvalue())
+
+
+class BenchmarkShopCommandTestCase(TestCase):
+    def test_benchmark_reports_and_rolls_back(self):
+        products_count = Product.objects.count()
+        cache.clear()
+        out = StringIO()
+        call_command(
+            'benchmark_shop',
+            '--users=2', '--products=5', '--orders-per-user=2', '--iterations=2', '--warmup=0',
+            '--only', 'shopapp:products-export', 'shopapp:order-list',
+            stdout=out, stderr=StringIO(),
+        )
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(report['meta']['volumes']['products'], 5)
+        self.assertEqual(set(report['results']), {'wsgi'})
+        self.assertEqual(set(report['results']['wsgi']), {'shopapp:products-export', 'shopapp:order-list'})
+        for result in report['results']['wsgi'].values():
+            self.assertEqual(result['status'], 200)
+            self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['max'])
+        self.assertEqual(Product.objects.count(), products_count)
+        # nothing cached for the seeded rows is left behind
+        self.assertFalse(caches['shared'].has_key(PRODUCTS_GENERATION))
+
+    def test_compare_handlers(self):
+        out = StringIO()
+        call_command(
+            'benchmark_shop',
+            '--users=2', '--products=5', '--iterations=1', '--warmup=0',
+            '--only', 'shopapp:orders_api_async', '--handlers', 'wsgi', 'asgi',
+            stdout=out, stderr=StringIO(),
+        )
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(report['results']['asgi']['shopapp:orders_api_async']['status'], 200)
+        self.assertIn('p50_ratio', report['comparison']['shopapp:orders_api_async'])
+
+
+class AsyncApiTestCase(TestCase):
+    def test_async_endpoints_match_sync_ones(self):
+        user = User.objects.create_user(username='async_api_user')
+        products = [Product.objects.create(name=f'Async API product {letter}', price=10) for letter in 'cab']
+        order = Order.objects.create(user=user, delivery_address='Async street')
+        order.products.add(*products)
+
+        for sync_name, async_name in (('products_api', 'products_api_async'), ('orders_api', 'orders_api_async')):
+            with self.subTest(view=async_name):
+                expected = self.client.get(reverse(f'shopapp:{sync_name}'), HTTP_ACCEPT='application/json').json()
+                response = async_to_sync(self.async_client.get)(reverse(f'shopapp:{async_name}'))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected)
+
+
+class SeedShopTestCase(TestCase):
+    def seed(self, **options):
+        config = SeedConfig(users=20, products=30, orders_per_user=(1, 3), batch_size=7, **options)
+        return seed_shop(config)
+
+    def test_seed_volumes(self):
+        result = self.seed(popularity='zipf')
+
+        self.assertEqual(User.objects.filter(pk__gte=result.first_user_id).count(), 20)
+        self.assertEqual(Product.objects.filter(pk__gte=result.first_product_id).count(), 30)
+        orders = Order.objects.filter(pk__gte=result.first_order_id)
+        self.assertEqual(orders.count(), result.orders)
+        self.assertTrue(20 <= result.orders <= 60)
+        self.assertEqual(Order.products.through.objects.filter(order__in=orders).count(), result.order_products)
+        self.assertEqual(orders.filter(products__isnull=True).count(), 0)
+
+    def test_zipf_orders_can_hold_whole_catalog(self):
+        result = seed_shop(SeedConfig(users=3, products=2, products_per_order=(2, 2), popularity='zipf'))
+        orders = Order.objects.filter(pk__gte=result.first_order_id)
+        self.assertEqual(result.order_products, 2 * result.orders)
+        self.assertEqual(orders.filter(items_count=2).count(), result.orders)
+
+        rng = random.Random(1)
+        self.assertEqual({pick_product(rng, 3, 'zipf') for _ in range(1000)}, {0, 1, 2})
+
+    def test_seed_is_deterministic(self):
+        def snapshot(result):
+            return list(Order.objects
+                        .filter(pk__gte=result.first_order_id)
+                        .order_by('pk')
+                        .values_list('delivery_address', 'created_at', 'products__name'))
+
+        with transaction.atomic():
+            first = snapshot(self.seed(seed=42))
+            transaction.set_rollback(True)
+        second = snapshot(self.seed(seed=42))
+        self.assertEqual(first, second)
@@ -0,0 +1,182 @@
+"""
+Resized derivatives of product images.
+
+Every uploaded Product.preview and ProductImage.image gets a WebP and a JPEG
+copy per THUMBNAIL_WIDTHS width, stored next to the original as
+``<name>-<width>w.<ext>``. Resizing runs in a process pool once the upload is
+committed, so requests never wait for Pillow. Images are never upscaled:
+widths above the original's are saved at the original width, which keeps the
+set of files the same for every image.
+
+Once a set is complete, its thumbnails_key is stored on the image's row, in
+the ``<image field>_thumbnails_key`` field. Templates and the API read that
+field (has_thumbnails) and fall back to the original file until it matches
+the current image and widths, so rendering never touches the storage.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from pathlib import PurePosixPath
+from typing import Callable
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Model
+from django.db.models.fields.files import FieldFile
+
+logger = logging.getLogger(__name__)
+
+# content type, Pillow format and save options per derivative format, the fallback last
+FORMATS = {
+    'webp': ('image/webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('image/jpeg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+def thumbnail_name(name: str, width: int, extension: str) -> str:
+    path = PurePosixPath(name)
+    return str(path.with_name(f'{path.stem}-{width}w.{extension}'))
+
+
+def thumbnail_names(name: str) -> list[str]:
+    """
+    Derivative names in the order they are written, so the last one marks a complete set
+    """
+    return [
+        thumbnail_name(name, width, extension)
+        for extension in FORMATS
+        for width in settings.THUMBNAIL_WIDTHS
+    ]
+
+
+def make_thumbnails(source: str, targets: list[tuple[str, int, str]]) -> None:
+    """
+    Writes (path, width, extension) targets resized from the ``source`` path.
+    Runs in pool processes, so it only deals with file paths.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    for path, width, extension in targets:
+        _, image_format, options = FORMATS[extension]
+        resized = image.copy()
+        # bounded by width only, thumbnail() keeps the aspect ratio and never upscales
+        resized.thumbnail((width, image.height), Image.Resampling.LANCZOS)
+        resized = resized.convert('RGB' if image_format == 'JPEG' or resized.mode == 'RGB' else 'RGBA')
+        # written under a temporary name, so a half-written file is never served
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        resized.save(tmp_path, image_format, **options)
+        os.replace(tmp_path, path)
+
+
+def thumbnails_key(name: str) -> str:
+    """
+    Stored once the set of ``name`` is complete; it changes with the image and with THUMBNAIL_WIDTHS
+    """
+    return '{}@{}'.format(name, ','.join(map(str, settings.THUMBNAIL_WIDTHS)))
+
+
+def thumbnails_exist(name: str) -> bool:
+    return bool(name) and default_storage.exists(thumbnail_names(name)[-1])
+
+
+def has_thumbnails(image: FieldFile) -> bool:
+    """
+    Whether the row of ``image`` records a complete set for it, without a storage lookup
+    """
+    return bool(image) and getattr(image.instance, f'{image.field.name}_thumbnails_key') == thumbnails_key(image.name)
+
+
+def mark_thumbnails(model: type[Model], pk: int, field_name: str, name: str) -> bool:
+    """
+    Records the complete set of ``name`` on the row, unless its image changed meanwhile
+    """
+    return bool(model._default_manager
+                .filter(pk=pk, **{field_name: name})
+                .update(**{f'{field_name}_thumbnails_key': thumbnails_key(name)}))
+
+
+def srcset(name: str, extension: str) -> str:
+    """
+    ``srcset`` attribute value for one derivative format of a complete set
+    """
+    return ', '.join(
+        f'{default_storage.url(thumbnail_name(name, width, extension))} {width}w'
+        for width in settings.THUMBNAIL_WIDTHS
+    )
+
+
+def thumbnail_urls(image: FieldFile) -> dict[str, list[dict]]:
+    """
+    Derivative URLs by format for API clients, empty while the set isn't complete
+    """
+    if not has_thumbnails(image):
+        return {}
+    name = image.name
+    return {
+        extension: [
+            {'width': width, 'url': default_storage.url(thumbnail_name(name, width, extension))}
+            for width in settings.THUMBNAIL_WIDTHS
+        ]
+        for extension in FORMATS
+    }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> Executor | None:
+    global _executor
+    if settings.THUMBNAIL_WORKERS < 1:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # forking a threaded server process is unsafe, workers start fresh
+                _executor = ProcessPoolExecutor(
+                    max_workers=settings.THUMBNAIL_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+    return _executor
+
+
+def generate_thumbnails(name: str, on_done: Callable[[], None] = None, force: bool = False) -> Future | None:
+    """
+    Creates the derivatives of a stored image in the pool, or inline when
+    THUMBNAIL_WORKERS is 0. ``on_done`` runs once they are written, right away
+    if they already exist (then no future is returned).
+    """
+    if not name:
+        return None
+    if not force and thumbnails_exist(name):
+        if on_done is not None:
+            on_done()
+        return None
+    targets = [
+        (default_storage.path(thumbnail_name(name, width, extension)), width, extension)
+        for extension in FORMATS
+        for width in settings.THUMBNAIL_WIDTHS
+    ]
+
+    def finished(future: Future) -> None:
+        if future.exception() is not None:
+            logger.error('Thumbnails of %s failed', name, exc_info=future.exception())
+        elif on_done is not None:
+            on_done()
+
+    future = Future()
+    executor = get_executor()
+    if executor is None:
+        try:
+            future.set_result(make_thumbnails(default_storage.path(name), targets))
+        except Exception as exc:
+            future.set_exception(exc)
+    else:
+        future = executor.submit(make_thumbnails, default_storage.path(name), targets)
+    future.add_done_callback(finished)
+    return future
@@ -0,0 +1,95 @@
+"""
+Denormalized order totals.
+
+Order.total_amount is the sum of the discounted prices of the order's products
+and Order.items_count their number. Signals keep them up to date with
+increments (F() updates, so concurrent changes don't overwrite each other),
+code that writes with bulk_create/bulk_update recalculates the orders it
+touched, and the reconcile_order_totals command fixes any drift.
+
+Amounts are computed in Python with Decimal, the same way everywhere, so an
+incremental update and a recalculation always agree to the cent. SQLite
+stores decimals as floating point numbers, so increments are rounded to the
+cent in SQL, or sums such as 0.1 + 0.2 would be stored with float noise that
+exact and range filters trip over.
+"""
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Iterable
+
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast, Round
+
+from .models import Order, Product
+
+CENT = Decimal('0.01')
+
+
+def line_amount(price: Decimal, discount: int) -> Decimal:
+    """
+    Price of one product in an order, ``discount`` being a percentage
+    """
+    return (Decimal(price) * (100 - (discount or 0)) / 100).quantize(CENT, ROUND_HALF_UP)
+
+
+def product_amounts(product_ids: Iterable[int]) -> dict[int, Decimal]:
+    return {
+        pk: line_amount(price, discount)
+        for pk, price, discount in Product.objects.filter(pk__in=set(product_ids)).values_list('pk', 'price', 'discount')
+    }
+
+
+def change_order_totals(order_ids: Iterable[int], amount: Decimal, count: int) -> None:
+    """
+    Adds ``amount`` and ``count`` (negative to subtract) to the totals of the orders
+    """
+    order_ids = set(order_ids)
+    if order_ids and (amount or count):
+        Order.objects.filter(pk__in=order_ids).update(
+            total_amount=Round(F('total_amount') + amount, 2),
+            items_count=F('items_count') + count,
+        )
+
+
+def calculate_order_totals(order_ids: Iterable[int]) -> dict[int, tuple[Decimal, int]]:
+    """
+    Totals of the orders from their product links, in one query
+    """
+    order_ids = set(order_ids)
+    totals = {pk: (Decimal('0.00'), 0) for pk in order_ids}
+    links = (Order.products.through.objects
+             .filter(order_id__in=order_ids)
+             .values_list('order_id', 'product__price', 'product__discount'))
+    amounts, counts = defaultdict(Decimal), defaultdict(int)
+    for order_id, price, discount in links:
+        amounts[order_id] += line_amount(price, discount)
+        counts[order_id] += 1
+    for order_id in counts:
+        totals[order_id] = (amounts[order_id].quantize(CENT), counts[order_id])
+    return totals
+
+
+def recalculate_order_totals(order_ids: Iterable[int], batch_size: int = 500) -> list[Order]:
+    """
+    Stores recalculated totals of the orders, returns the orders that were wrong.
+    Stored amounts are compared as the database holds them: a decimal field
+    is quantized when read, which would hide float noise on SQLite.
+    """
+    order_ids = sorted(set(order_ids))
+    fixed = []
+    for start in range(0, len(order_ids), batch_size):
+        batch_ids = order_ids[start:start + batch_size]
+        totals = calculate_order_totals(batch_ids)
+        changed = []
+        orders = (Order.objects
+                  .filter(pk__in=batch_ids)
+                  .only('pk', 'user_id', 'total_amount', 'items_count')
+                  .annotate(stored_amount=Cast('total_amount', FloatField())))
+        for order in orders:
+            total_amount, items_count = totals[order.pk]
+            if (order.stored_amount, order.items_count) != (float(total_amount), items_count):
+                order.total_amount, order.items_count = total_amount, items_count
+                changed.append(order)
+        Order.objects.bulk_update(changed, ['total_amount', 'items_count'])
+        fixed.extend(changed)
+    return fixed
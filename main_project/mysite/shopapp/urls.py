@@ -1,6 +1,8 @@
 from django.contrib.auth.decorators import login_required
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+
+from .caching import PRODUCT_DETAILS_PAGES, PRODUCTS_FEED_PAGES, PRODUCTS_LIST_PAGES, cache_public_page
 from .views import (
     ShopIndexView,
     GroupsListView,
@@ -19,6 +21,8 @@ from .views import (
     OrdersDataExportView,
     ProductsApi,
     OrdersApi,
+    AsyncProductsApi,
+    AsyncOrdersApi,
     ProductViewSet,
     OrdersViewSet, LatestProductsFeed, UserOrdersListView, UserOrdersExportView,
 )
@@ -33,10 +37,14 @@ routers.register('orders', OrdersViewSet)
 urlpatterns = [
     path('', ShopIndexView.as_view(), name='index'),
     path('groups/', GroupsListView.as_view(), name='groups_list'),
-    path('products/', ProductsListView.as_view(), name='products_list'),
+    path('products/', cache_public_page(PRODUCTS_LIST_PAGES)(ProductsListView.as_view()), name='products_list'),
     path('products/export/', ProductsDataExportView.as_view(), name='products-export'),
     path('products/create', ProductCreateView.as_view(), name='product_create'),
-    path('products/<int:pk>/', ProductDetailsView.as_view(), name='product_details'),
+    path(
+        'products/<int:pk>/',
+        cache_public_page(PRODUCT_DETAILS_PAGES)(ProductDetailsView.as_view()),
+        name='product_details',
+    ),
     path('products/<int:pk>/update/', ProductUpdateView.as_view(), name='product_update'),
     path('products/<int:pk>/confirm-archive/', ProductDeleteView.as_view(), name='product_delete'),
     path('orders/create', OrderCreateView.as_view(), name='order_create'),
@@ -49,9 +57,11 @@ urlpatterns = [
 
     path('products/api', ProductsApi.as_view(), name='products_api'),
     path('orders/api', OrdersApi.as_view(), name='orders_api'),
+    path('products/api/async', AsyncProductsApi.as_view(), name='products_api_async'),
+    path('orders/api/async', AsyncOrdersApi.as_view(), name='orders_api_async'),
     path('api/', include(routers.urls)),
 
-    path('latest/feed/', LatestProductsFeed(), name='products_feed'),
+    path('latest/feed/', cache_public_page(PRODUCTS_FEED_PAGES)(LatestProductsFeed()), name='products_feed'),
 
     path('users/<int:user_id>/orders/', login_required(UserOrdersListView.as_view()), name='users_orders'),
     path('users/<int:user_id>/orders/export/', UserOrdersExportView.as_view(), name='user_orders_export')
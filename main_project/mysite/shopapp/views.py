@@ -1,21 +1,32 @@
 import logging
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.syndication.views import Feed
-from django.core.cache import cache
+from django.db.models import QuerySet
 from django.http import HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, redirect, reverse, get_object_or_404
 from django.urls import reverse_lazy, reverse as r
+from django.utils.decorators import method_decorator
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 
+from mysite.cache import get_or_compute
+from .bulk import bulk_create_products, bulk_update_products
+from .caching import product_card_version, user_orders_export_cache_key
+from .conditional import conditional_view, orders_validators, products_validators, user_orders_validators
 from .models import Product, Order
+from .pagination import OrderKeysetPagination, ProductKeysetPagination, paginate_keyset
+from .search import ProductSearchFilter
 from django.views import View
 from django.contrib.auth.models import Group, User
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 from .forms import OrderForm, GroupForm
+from rest_framework import status
+from rest_framework.decorators import action
 from rest_framework.request import Request
 from rest_framework.response import Response
-from .serializers import ProductSerializer, OrdersSerializer
+from .serializers import ProductSerializer, OrdersSerializer, OrderWithoutProductsSerializer
+from .streaming import EXPORT_FORMATS, streaming_export_response, unknown_format_response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.filters import SearchFilter
@@ -25,20 +36,25 @@ logger = logging.getLogger(__name__)
 
 
 class UserOrdersExportView(View):
+    @method_decorator(conditional_view(user_orders_validators))
     def get(self, request: HttpRequest, **kwargs) -> JsonResponse:
         owner = get_object_or_404(User, pk=self.kwargs['user_id'])
-        cache_name = f'user_orders_data_export_{owner.id}'
-        serialized_data = cache.get(cache_name)
+        # The key carries the owner's orders generation, which is bumped by
+        # signals whenever their orders change, so the entry never expires.
+        cache_name = user_orders_export_cache_key(owner.id)
 
-        if serialized_data is None:
-            orders = Order.objects.filter(user=owner).order_by('pk').all()
-            serialized = OrdersSerializer(orders, many=True)
-            serialized_data = serialized.data
-            cache.set(cache_name, serialized_data, 300)
-            print('Делаем запрос в бд')
+        def serialize():
+            orders = self.orders_queryset(owner.id)
+            logger.debug('User %s orders export cached as %s', owner.id, cache_name)
+            return OrdersSerializer(orders, many=True).data
 
+        serialized_data = get_or_compute(cache_name, serialize, timeout=None)
         return JsonResponse({'orders': serialized_data})
 
+    @staticmethod
+    def orders_queryset(user_id: int) -> QuerySet:
+        return Order.objects.filter(user_id=user_id).order_by('pk').prefetch_related('products')
+
 
 class UserOrdersListView(ListView):
     model = Order
@@ -53,16 +69,14 @@ class UserOrdersListView(ListView):
             'user': owner,
             'orders': orders,
         }
-        print('queryset', queryset)
+        logger.debug('User orders queryset %s', queryset)
         self.queryset = queryset
         return queryset
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data()
-        print('context', context)
         context['data'] = self.queryset
-        print('context', context)
-        print('context[data]', context['data'])
+        logger.debug('User orders context %s', context)
         return context
 
 
@@ -72,13 +86,13 @@ class LatestProductsFeed(Feed):
     link = reverse_lazy('shopapp:products_list')
 
     def items(self):
-        return Order.objects.order_by('-created_at')[:5]
+        return Order.objects.order_by('-created_at').prefetch_related('products')[:5]
 
     def item_title(self, item: Order):
         return item.pk
 
     def item_description(self, item: Order):
-        return item.products
+        return ', '.join(product.name for product in item.products.all())
 
     def item_link(self, item: Product):
         return reverse('shopapp:order_details', kwargs={'pk': item.pk})
@@ -87,8 +101,9 @@ class LatestProductsFeed(Feed):
 class ProductViewSet(ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = ProductKeysetPagination
     filter_backends = [
-        SearchFilter,
+        ProductSearchFilter,
         DjangoFilterBackend,
     ]
     search_fields = ['name', 'description']
@@ -100,10 +115,51 @@ class ProductViewSet(ModelViewSet):
         'archived'
     ]
 
+    bulk_max_items = 5000
+
+    @method_decorator(conditional_view(products_validators))
+    def list(self, request: Request, *args, **kwargs) -> Response:
+        return super().list(request, *args, **kwargs)
+
+    def bulk_response(self, request: Request, apply, success_status: int) -> Response:
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'detail': 'Expected a list of products.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.bulk_max_items:
+            return Response(
+                {'detail': f'At most {self.bulk_max_items} products per request.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results = apply(items)
+        failed = sum(1 for result in results if 'errors' in result)
+        if not failed:
+            response_status = success_status
+        elif failed == len(results):
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS
+        return Response(results, status=response_status)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request: Request) -> Response:
+        """
+        Creates a list of products; the response has a result per item in request order
+        """
+        return self.bulk_response(request, bulk_create_products, status.HTTP_201_CREATED)
+
+    @bulk.mapping.patch
+    def bulk_update(self, request: Request) -> Response:
+        """
+        Partially updates a list of products, each item identified by its pk
+        """
+        return self.bulk_response(request, bulk_update_products, status.HTTP_200_OK)
+
 
 class OrdersViewSet(ModelViewSet):
-    queryset = Order.objects.all()
+    queryset = Order.objects.prefetch_related('products')
     serializer_class = OrdersSerializer
+    pagination_class = OrderKeysetPagination
     filter_backends = [
         SearchFilter,
         DjangoFilterBackend,
@@ -113,12 +169,14 @@ class OrdersViewSet(ModelViewSet):
         'created_at',
         'promocode',
     ]
-    filterset_fields = [
-        'delivery_address',
-        'created_at',
-        'user',
-        'promocode',
-    ]
+    filterset_fields = {
+        'delivery_address': ['exact'],
+        'created_at': ['exact'],
+        'user': ['exact'],
+        'promocode': ['exact'],
+        'total_amount': ['exact', 'gte', 'lte'],
+        'items_count': ['exact', 'gte', 'lte'],
+    }
 
 
 class ProductsApi(APIView):
@@ -130,11 +188,40 @@ class ProductsApi(APIView):
 
 class OrdersApi(APIView):
     def get(self, request: Request) -> Response:
-        orders = Order.objects.all()
+        orders = Order.objects.prefetch_related('products')
         serialized = OrdersSerializer(orders, many=True)
         return Response({'orders': serialized.data})
 
 
+class AsyncProductsApi(View):
+    """
+    Same payload as ProductsApi, served without leaving the event loop under ASGI
+    """
+    async def get(self, request: HttpRequest) -> JsonResponse:
+        products = [product async for product in Product.objects.all()]
+        serialized = ProductSerializer(products, many=True)
+        return JsonResponse({'products': serialized.data})
+
+
+class AsyncOrdersApi(View):
+    """
+    Same payload as OrdersApi. prefetch_related doesn't work with async iteration
+    in Django 4.2, so product ids are read from the through table in a second query.
+    """
+    async def get(self, request: HttpRequest) -> JsonResponse:
+        orders = [order async for order in Order.objects.all()]
+        products = {}
+        # products in Product.Meta.ordering, like order.products.all() in OrdersSerializer
+        through = Order.products.through.objects.order_by('order_id', 'product__name', 'product__price')
+        async for order_id, product_id in through.values_list('order_id', 'product_id'):
+            products.setdefault(order_id, []).append(product_id)
+
+        serialized = OrderWithoutProductsSerializer(orders, many=True).data
+        for order in serialized:
+            order['products'] = products.get(order['pk'], [])
+        return JsonResponse({'orders': serialized})
+
+
 class ShopIndexView(View):
     def get(self, request: HttpRequest) -> HttpResponse:
         products = [
@@ -232,7 +319,29 @@ class ProductDetailsView(DetailView):
 class ProductsListView(ListView):
     template_name = 'shopapp/products-list.html'
     context_object_name = 'products'
-    queryset = Product.objects.filter(archived=False)
+    queryset = Product.objects.filter(archived=False).select_related('created_by')
+    # Meta.ordering plus pk, served by the partial index on non-archived products
+    ordering_fields = ('name', 'price', 'pk')
+    page_size = 20
+
+    def get_queryset(self):
+        self.page = paginate_keyset(
+            super().get_queryset(),
+            self.ordering_fields,
+            self.page_size,
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'),
+        )
+        for product in self.page.object_list:
+            product.card_version = product_card_version(product)
+        return self.page.object_list
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['next_cursor'] = self.page.next_cursor
+        context['previous_cursor'] = self.page.previous_cursor
+        context['card_timeout'] = settings.PAGE_CACHE_TIMEOUT
+        return context
 
 
 class ProductCreateView(PermissionRequiredMixin, CreateView):
@@ -277,39 +386,77 @@ class ProductDeleteView(DeleteView):
 
 
 class ProductsDataExportView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
-        products = Product.objects.order_by('pk').all()
-        products_data = [
-            {
-                'pk': product.pk,
-                'name': product.name,
-                'price': product.price,
-                'archived': product.archived
-            }
-            for product in products
-        ]
-        elem = products_data[0]
-        name = elem['name']
-        print('name:', name)
-        return JsonResponse({'products': products_data})
+    """
+    Streams all products as ``{"products": [...]}`` or, with ``?format=ndjson``,
+    as one product per line. Rows are read in chunks, so memory stays flat
+    regardless of catalog size.
+    """
+    chunk_size = 2000
+
+    @method_decorator(conditional_view(products_validators))
+    def get(self, request: HttpRequest) -> HttpResponse:
+        export_format = request.GET.get('format', 'json')
+        if export_format not in EXPORT_FORMATS:
+            return unknown_format_response()
+
+        products = self.products_queryset().iterator(chunk_size=self.chunk_size)
+        return streaming_export_response(products, 'products', export_format, self.chunk_size)
+
+    @staticmethod
+    def products_queryset() -> QuerySet:
+        return Product.objects.order_by('pk').values('pk', 'name', 'price', 'archived')
 
 
 class OrdersDataExportView(UserPassesTestMixin, View):
+    """
+    Streams all orders with their product ids. Orders and order-product links
+    are read as two pk-ordered cursors and merged, so the export costs two
+    queries no matter how many orders there are.
+    """
+    chunk_size = 2000
+
     def test_func(self):
         if self.request.user.is_staff:
             return True
-    def get(self, request: HttpRequest) -> JsonResponse:
-        orders = Order.objects.order_by('pk').all()
-        orders_data = [
-            {
-                'pk': order.pk,
-                'address': order.delivery_address,
-                'promocode': order.promocode,
-                'user_is': str(order.user),
-                'products': str(order.products.all())
+
+    @method_decorator(conditional_view(orders_validators))
+    def get(self, request: HttpRequest) -> HttpResponse:
+        export_format = request.GET.get('format', 'json')
+        if export_format not in EXPORT_FORMATS:
+            return unknown_format_response()
+        return streaming_export_response(self.iter_orders_data(), 'orders', export_format, self.chunk_size)
+
+    @staticmethod
+    def orders_queryset() -> QuerySet:
+        return (Order.objects
+                .order_by('pk')
+                .values_list('pk', 'delivery_address', 'promocode', 'user__username', 'total_amount', 'items_count'))
+
+    @staticmethod
+    def links_queryset() -> QuerySet:
+        return (Order.products.through.objects
+                .order_by('order_id', 'product_id')
+                .values_list('order_id', 'product_id'))
+
+    def iter_orders_data(self):
+        orders = self.orders_queryset().iterator(chunk_size=self.chunk_size)
+        links = self.links_queryset().iterator(chunk_size=self.chunk_size)
+
+        link = next(links, None)
+        for pk, address, promocode, username, total_amount, items_count in orders:
+            product_ids = []
+            while link is not None and link[0] <= pk:
+                if link[0] == pk:
+                    product_ids.append(link[1])
+                link = next(links, None)
+            yield {
+                'pk': pk,
+                'address': address,
+                'promocode': promocode,
+                'user_is': username,
+                'products': product_ids,
+                'total_amount': total_amount,
+                'items_count': items_count,
             }
-            for order in orders
-        ]
-        return JsonResponse({'orders': orders_data})
 
 